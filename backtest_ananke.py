@@ -1,204 +1,222 @@
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from settings import indicators
 from settings import backtest
+from settings import signals
+from settings import klines
+from settings import resample
 from settings.connect import binance_client, sqlalchemy_create_engine
+from settings.exchange import exchange_info
 from settings.log import start_logging
+from settings.metrics import LatencyTracker, stage_metrics
 
 # Settings for backtest
 initial_balance = 100.0
 balance = 0.0
-positions = {}
-trade_history = []
+positions = backtest.PositionBook()
+trade_history = backtest.TradeLedger()
 risk_per_trade = 0.1
+# Exit rules on top of backtest.EXIT_RULES, e.g. {'atr_stop': 2} for a stop two ATRs from the entry
+exit_rules = {}
 
 # Set up log
 logger = start_logging('settings/strategies/ananke_backtest')
 
+# Phase timings of the last backtest
+metrics_file = 'settings/strategies/ananke_backtest_metrics.json'
 
-def search_entry_point(df: pd.DataFrame) -> pd.DataFrame:
+# Local kline cache in front of the MySQL klines table
+kline_cache = klines.KlineCache()
+
+# Candle interval to test, any multiple of the stored klines.BASE_INTERVAL (e.g. '15m', '1h', '4h')
+interval = klines.BASE_INTERVAL
+
+
+def load_symbol(engine, symbol: str, refresh: bool = True, start=None, end=None,
+                interval: str = klines.BASE_INTERVAL) -> pd.DataFrame:
+    """Load the klines of a symbol through the local cache, ready for search_entry_point.
+
+    High and low are loaded along with close to compute the atr column once,
+    for the ATR stop. Longer intervals are resampled from the cached base
+    candles.
+    """
+    df = klines.load_klines(engine, symbol, kline_cache, refresh, start, end,
+                            columns=('high', 'low', 'close'))
+    df = resample.resample_frame(df, interval)
+    df['symbol'] = symbol
+    df = df.dropna(subset=['close'])
+    df['atr'] = indicators.atr(df['high'].to_numpy(), df['low'].to_numpy(),
+                               df['close'].to_numpy(), backtest.ATR_PERIOD)
+    df['signal'] = ''
+    return df
+
+
+def batch_indicators(dfs: dict[str, pd.DataFrame], chunk_size: int = 32) -> dict[str, dict]:
+    """Compute RSI and MACD for many symbols at once, chunked by series length"""
+    def rsi_and_macd(prices):
+        return {'rsi': indicators.rsi_batch(prices, window=14), **indicators.macd_batch(prices)}
+
+    symbols = list(dfs)
+    values = indicators.batch_apply(
+        [pd.to_numeric(dfs[symbol]['close'], errors='coerce').values for symbol in symbols], rsi_and_macd, chunk_size)
+    return dict(zip(symbols, values))
+
+
+def search_entry_point(df: pd.DataFrame, indicator_values: dict = None) -> pd.DataFrame:
     """Calculate trading signals using RSI and MACD with your specific indicators"""
     df = df.copy()
 
-    # Get close prices as numpy array
-    close_prices = pd.to_numeric(df['close'], errors='coerce').values
+    if indicator_values is None:
+        # Get close prices as numpy array
+        close_prices = pd.to_numeric(df['close'], errors='coerce').values
 
-    # Calculate indicators for entire series
-    rsi_values = indicators.rsi(close_prices, window=14)
-    macd_data = indicators.macd(close_prices)
+        # Calculate indicators for entire series
+        rsi_values = indicators.rsi(close_prices, window=14)
+        macd_data = indicators.macd(close_prices)
+    else:
+        rsi_values = indicator_values['rsi']
+        macd_data = indicator_values
 
     # Extract MACD components
     macd_line = macd_data['macd_line']
     signal_line = macd_data['signal_line']
 
-    # Calculate MACD crossovers
-    macd_above = macd_line > signal_line
-    macd_cross_up = np.zeros_like(macd_above, dtype=bool)
-    macd_cross_down = np.zeros_like(macd_above, dtype=bool)
-
-    # Manual shift for crossover detection (since we're using numpy arrays)
-    for i in range(1, len(macd_above)):
-        macd_cross_up[i] = macd_above[i] and not macd_above[i-1]
-        macd_cross_down[i] = not macd_above[i] and macd_above[i-1]
-
-    # Generate signals
-    for i in range(len(df)):
-        # Skip if indicators haven't warmed up yet
-        if (np.isnan(rsi_values[i]) or
-            np.isnan(macd_line[i]) or
-            np.isnan(signal_line[i]) or
-                i < 1):  # Need at least 2 periods for crossover detection
-            continue
-
-        # Buy signal: RSI < 30 + MACD crossover up
-        if (rsi_values[i] < 30 and
-            macd_cross_up[i] and
-                not np.isnan(rsi_values[i])):
-            df.loc[df.index[i], 'signal'] = 'BUY'
-
-        # Sell signal: RSI > 70 + MACD crossover down
-        elif (rsi_values[i] > 70 and
-              macd_cross_down[i] and
-              not np.isnan(rsi_values[i])):
-            df.loc[df.index[i], 'signal'] = 'SELL'
-
-        # Keep existing signal if no new signal
-        elif pd.isna(df.loc[df.index[i], 'signal']) or df.loc[df.index[i], 'signal'] == '':
-            df.loc[df.index[i], 'signal'] = ''
+    # Build BUY/SELL codes for the whole series at once
+    codes = signals.crossover_signals(rsi_values, macd_line, signal_line)
+    ready = signals.indicators_ready(rsi_values, macd_line, signal_line)
+
+    # Keep existing signals where no new signal fires, blank them once warmed up
+    if 'signal' in df:
+        signal = df['signal'].to_numpy(dtype=object, copy=True)
+        dtype = df['signal'].dtype
+    else:
+        signal = np.full(len(df), np.nan, dtype=object)
+        dtype = object
+    fired = codes != 0
+    signal[fired] = signals.signal_labels(codes[fired])
+    signal[ready & ~fired & pd.isna(signal)] = ''
+    df['signal'] = pd.Series(signal, index=df.index, dtype=dtype)
 
     return df
 
 
-def test_on_btc(initial_balance: float, balance: float, positions: dict, trade_history: list, risk_per_trade: float):
+def test_on_btc(initial_balance: float, balance: float, positions: backtest.PositionBook, trade_history: backtest.TradeLedger, risk_per_trade: float,
+                exit_rules: dict = None):
     """Run backtest on BTC/USDC pair"""
     logger.info('TESTING on BTCUSDC')
 
     engine = sqlalchemy_create_engine()
     symbol = 'BTCUSDC'
 
-    # Minimal query - only get what we need
-    query = f"""
-    SELECT 
-        open_time AS timestamp,
-        close
-    FROM klines
-    WHERE symbol = '{symbol}'
-    ORDER BY open_time ASC
-    """
-
     try:
-        df = pd.read_sql(query, engine)
+        with stage_metrics.timer('backtest_load'):
+            df = load_symbol(engine, symbol)
 
         if df.empty:
             logger.error("No data for %s", symbol)
             return
 
-        # Convert and clean data
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        df.set_index('timestamp', inplace=True)
-        df['symbol'] = symbol
-        df['close'] = pd.to_numeric(df['close'], errors='coerce')
-        df = df.dropna(subset=['close'])
-        df['signal'] = ''
-
         # Compute signals for entire DataFrame
-        df = search_entry_point(df)
+        with stage_metrics.timer('backtest_signals'):
+            df = search_entry_point(df)
 
         balance = initial_balance
 
         # Process each candle
-        for i in range(len(df)):
-            kline = df.iloc[i:i+1].copy()
-            if not kline['signal'].empty and kline['signal'].iloc[0] in ['BUY', 'SELL']:
-                balance, positions, trade_history = backtest.open_position(
-                    kline, balance, positions, trade_history, risk_per_trade, logger)
-                balance, positions, trade_history = backtest.manage_positions(
-                    kline, balance, positions, trade_history, logger)
-
-        # Final liquidation
-        if not df.empty:
-            balance, positions, trade_history = backtest.close_all_positions(
-                {symbol: df}, balance, positions, trade_history, logger)
-
-        # Calculate performance
-        metrics = backtest.calculate_metrics(
-            initial_balance, balance, trade_history, True, logger)
-
-    except Exception as e:
-        logger.error("Backtest failed: %s", str(e))
-        raise
-
-
-def test_on_all_pairs_independently(initial_balance: float, risk_per_trade: str):
-    """Run backtest on all pairs independtly"""
-    logger.info('TESTING on all pairs independently')
-
-    engine = sqlalchemy_create_engine()
-
-    # Query for symbols
-    query = """
-    SELECT DISTINCT symbol 
-    FROM klines 
-    ORDER BY symbol
-    """
-
-    try:
-        symbols = (pd.read_sql(query, engine))['symbol'].tolist()
-
-        for symbol in symbols:
-            # Minimal query - only get what we need
-            query = f"""
-            SELECT 
-                open_time AS timestamp,
-                close
-            FROM klines
-            WHERE symbol = '{symbol}'
-            ORDER BY open_time ASC
-            """
-            df = pd.read_sql(query, engine)
-
-            # Convert and clean data
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df.set_index('timestamp', inplace=True)
-            df['symbol'] = symbol
-            df['close'] = pd.to_numeric(df['close'], errors='coerce')
-            df = df.dropna(subset=['close'])
-            df['signal'] = ''
-
-            # Compute signals for entire DataFrame
-            df = search_entry_point(df)
-
-            balance = initial_balance
-            positions = {}
-            trade_history = []
-
-            # Process each candle
+        with stage_metrics.timer('backtest_simulation'):
             for i in range(len(df)):
                 kline = df.iloc[i:i+1].copy()
                 if not kline['signal'].empty and kline['signal'].iloc[0] in ['BUY', 'SELL']:
                     balance, positions, trade_history = backtest.open_position(
                         kline, balance, positions, trade_history, risk_per_trade, logger)
                     balance, positions, trade_history = backtest.manage_positions(
-                        kline, balance, positions, trade_history, logger)
+                        kline, balance, positions, trade_history, logger, exit_rules)
 
             # Final liquidation
             if not df.empty:
                 balance, positions, trade_history = backtest.close_all_positions(
                     {symbol: df}, balance, positions, trade_history, logger)
 
-            # Calculate performance
+        # Calculate performance
+        with stage_metrics.timer('backtest_metrics'):
             metrics = backtest.calculate_metrics(
                 initial_balance, balance, trade_history, True, logger)
 
+        logger.info('Phase timings:\n%s', stage_metrics.timings.summary())
+        stage_metrics.write(metrics_file)
+
     except Exception as e:
         logger.error("Backtest failed: %s", str(e))
         raise
 
 
-def test_ananke(initial_balance: float, balance: float, positions: dict, trade_history: list, risk_per_trade: float):
-    """Run backtest on Ananke strategy"""
+def backtest_symbol(symbol: str, initial_balance: float, risk_per_trade: float, engine=None,
+                    interval: str = klines.BASE_INTERVAL, exit_rules: dict = None):
+    """Backtest one symbol on its own balance; returns (symbol, metrics, trade ledger)"""
+    engine = engine or worker_engine()
+    with stage_metrics.timer('backtest_load'):
+        df = load_symbol(engine, symbol, interval=interval)
+
+    # Compute signals for entire DataFrame
+    with stage_metrics.timer('backtest_signals'):
+        df = search_entry_point(df)
+
+    balance = initial_balance
+    positions = backtest.PositionBook()
+    trade_history = backtest.TradeLedger()
+
+    # Process each signal candle
+    with stage_metrics.timer('backtest_simulation'):
+        for i in np.flatnonzero(df['signal'].isin(['BUY', 'SELL']).to_numpy()):
+            signal = df['signal'].iat[i]
+            price = float(df['close'].iat[i])
+            timestamp = df.index[i]
+            balance, positions, trade_history = backtest.open_position_at(
+                symbol, signal, price, timestamp, balance, positions, trade_history, risk_per_trade, logger)
+            balance, positions, trade_history = backtest.manage_position_at(
+                symbol, signal, price, timestamp, balance, positions, trade_history, logger, exit_rules,
+                current_atr=float(df['atr'].iat[i]))
 
-    logger.info('TESTING Ananke strategy')
+        # Final liquidation
+        if not df.empty:
+            balance, positions, trade_history = backtest.close_all_positions(
+                {symbol: df}, balance, positions, trade_history, logger)
+
+    # Calculate performance
+    with stage_metrics.timer('backtest_metrics'):
+        metrics = backtest.calculate_metrics(
+            initial_balance, balance, trade_history, True, logger)
+    return symbol, metrics, trade_history
+
+
+def backtest_symbol_in_worker(*args) -> tuple:
+    """backtest_symbol in a worker process, with the phase timings it recorded there"""
+    stage_metrics.timings = LatencyTracker()
+    result = backtest_symbol(*args)
+    return result, {stage: list(histogram.values) for stage, histogram in stage_metrics.timings.histograms.items()}
+
+
+_engine = None
+
+
+def worker_engine():
+    """One SQLAlchemy engine per process, created on first use"""
+    global _engine
+    if _engine is None:
+        _engine = sqlalchemy_create_engine()
+    return _engine
+
+
+def test_on_all_pairs_independently(initial_balance: float, risk_per_trade: float, workers: int = 1,
+                                    interval: str = klines.BASE_INTERVAL, exit_rules: dict = None):
+    """Run backtest on all pairs independently, on a pool of worker processes when workers > 1.
+
+    Returns a summary table with one row of metrics per symbol and the trade
+    ledger of every symbol.
+    """
+    logger.info('TESTING on all pairs independently')
 
     engine = sqlalchemy_create_engine()
 
@@ -210,78 +228,96 @@ def test_ananke(initial_balance: float, balance: float, positions: dict, trade_h
     """
 
     try:
-        client = binance_client()
-        binance_symbols = []
-        exchange_info_spot_symbols = client.exchange_info(permissions=['SPOT'])[
-            'symbols']
-        for symbol in exchange_info_spot_symbols:
-            binance_symbols.append(symbol['symbol'])
-
-        symbols = (pd.read_sql(query, engine))['symbol'].tolist()
-        logger.info('List of symbols obtained')
-
-        dfs = {}
-        for symbol in symbols:
-            # Minimal query - only get what we need
-            query = f"""
-            SELECT 
-                open_time AS timestamp,
-                close
-            FROM klines
-            WHERE symbol = '{symbol}'
-            ORDER BY open_time ASC
-            """
-            df = pd.read_sql(query, engine)
-
-            # Convert and clean data
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df.set_index('timestamp', inplace=True)
-            df['symbol'] = symbol
-            df['close'] = pd.to_numeric(df['close'], errors='coerce')
-            df = df.dropna(subset=['close'])
-            df['signal'] = ''
-
-            # Compute signals for entire DataFrame
-            df = search_entry_point(df)
+        with stage_metrics.timer('backtest_load'):
+            symbols = (pd.read_sql(query, engine))['symbol'].tolist()
+
+        if workers > 1:
+            # Each worker loads its own data and sends back metrics, ledger and phase timings
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                timed = list(pool.map(backtest_symbol_in_worker, symbols, repeat(initial_balance),
+                                      repeat(risk_per_trade), repeat(None), repeat(interval),
+                                      repeat(exit_rules)))
+            results = [result for result, _ in timed]
+            for _, timings in timed:
+                for stage, values in timings.items():
+                    for value in values:
+                        stage_metrics.timings.observe(stage, value)
+        else:
+            results = [backtest_symbol(symbol, initial_balance, risk_per_trade, engine, interval, exit_rules)
+                       for symbol in symbols]
+
+        summary = pd.DataFrame.from_dict(
+            {symbol: metrics for symbol, metrics, _ in results}, orient='index')
+        summary.index.name = 'symbol'
+        ledgers = {symbol: ledger for symbol, _, ledger in results}
+
+        logger.info('SUMMARY of %d pairs:\n%s', len(summary),
+                    summary.to_string() if not summary.empty else '')
+        logger.info('Phase timings:\n%s', stage_metrics.timings.summary())
+        stage_metrics.write(metrics_file)
+        return summary, ledgers
 
-            dfs[symbol] = df
+    except Exception as e:
+        logger.error("Backtest failed: %s", str(e))
+        raise
 
-        # Get all unique timestamps
-        timeline = backtest.create_unified_timeline(dfs)
 
-        logger.info("Starting portfolio backtest with %d symbols and %d timestamps",
-                    len(dfs), len(timeline))
+def test_ananke(initial_balance: float, balance: float, positions: backtest.PositionBook, trade_history: backtest.TradeLedger, risk_per_trade: float,
+                symbols: list = None, start=None, end=None, exit_rules: dict = None,
+                interval: str = klines.BASE_INTERVAL):
+    """Run backtest on Ananke strategy, optionally on a symbol subset, date range and candle interval"""
 
-        balance = initial_balance
+    logger.info('TESTING Ananke strategy on %s candles', interval)
 
-        # Main backtest loop
-        for i, timestamp in enumerate(timeline):
-            # Check for new signals in Binance order
-            for symbol in binance_symbols:
-                if symbol in dfs and timestamp in dfs[symbol].index:
-                    kline = dfs[symbol].loc[[timestamp]]
-                    if kline['signal'].iloc[0] in ['BUY', 'SELL'] and symbol not in positions:
-                        balance, positions, trade_history = backtest.open_position(
-                            kline, balance, positions, trade_history, risk_per_trade, logger)
-
-            # Manage existing positions
-            for symbol in list(positions.keys()):
-                if symbol in dfs and timestamp in dfs[symbol].index:
-                    kline = dfs[symbol].loc[[timestamp]]
-                    balance, positions, trade_history = backtest.manage_positions(
-                        kline, balance, positions, trade_history, logger)
+    engine = sqlalchemy_create_engine()
+
+    try:
+        client = binance_client()
+        binance_symbols = exchange_info(client).symbols
+
+        # Bring the local cache up to date, one streamed query per group of symbols
+        with stage_metrics.timer('backtest_load'):
+            added = kline_cache.sync_all(engine, symbols, end)
+            logger.info('Klines synced for %d symbols (%d new rows)',
+                        len(added), sum(added.values()))
+
+            dfs = {}
+            for symbol in added:
+                dfs[symbol] = load_symbol(
+                    engine, symbol, refresh=False, start=start, end=end, interval=interval)
+
+            # Symbols without candles in the range would break the indicator batch
+            empty = [symbol for symbol, df in dfs.items() if df.empty]
+            if empty:
+                logger.warning('Skipping %d symbols without %s candles: %s',
+                               len(empty), interval, ', '.join(empty))
+                for symbol in empty:
+                    del dfs[symbol]
+
+        # Compute indicators for all symbols in batches, then signals per symbol
+        with stage_metrics.timer('backtest_signals'):
+            indicator_values = batch_indicators(dfs)
+            for symbol, df in dfs.items():
+                dfs[symbol] = search_entry_point(df, indicator_values[symbol])
 
-            # Progress logging
-            if i % 1000 == 0:
-                logger.info("Processed %d/%d timestamps", i, len(timeline))
+        balance = initial_balance
 
-        # Final liquidation
-        balance, positions, trade_history = backtest.close_all_positions(
-            dfs, balance, positions, trade_history, logger)
+        # Event-driven portfolio loop over per-symbol cursors
+        with stage_metrics.timer('backtest_simulation'):
+            balance, positions, trade_history = backtest.run_portfolio(
+                dfs, binance_symbols, balance, positions, trade_history, risk_per_trade, logger, exit_rules)
+
+            # Final liquidation
+            balance, positions, trade_history = backtest.close_all_positions(
+                dfs, balance, positions, trade_history, logger)
 
         # Calculate performance
-        metrics = backtest.calculate_metrics(
-            initial_balance, balance, trade_history, True, logger)
+        with stage_metrics.timer('backtest_metrics'):
+            metrics = backtest.calculate_metrics(
+                initial_balance, balance, trade_history, True, logger)
+
+        logger.info('Phase timings:\n%s', stage_metrics.timings.summary())
+        stage_metrics.write(metrics_file)
 
     except Exception as e:
         logger.error("Backtest failed: %s", str(e))
@@ -290,9 +326,9 @@ def test_ananke(initial_balance: float, balance: float, positions: dict, trade_h
 
 if __name__ == '__main__':
     # test_on_btc(initial_balance, balance, positions,
-    #             trade_history, risk_per_trade)
+    #             trade_history, risk_per_trade, exit_rules)
     # test_on_all_pairs_independently(
-    #     initial_balance, risk_per_trade)
+    #     initial_balance, risk_per_trade, exit_rules=exit_rules)
     test_ananke(initial_balance, balance, positions,
-                trade_history, risk_per_trade)
+                trade_history, risk_per_trade, exit_rules=exit_rules, interval=interval)
     pass
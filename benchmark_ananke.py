@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+# backtest_ananke logs into settings/strategies on import
+os.makedirs('settings/strategies', exist_ok=True)
+
+import backtest_ananke
+from settings import indicators
+from settings import backtest
+from settings import synthetic
+
+
+# Engine logs are kept out of the timings
+logger = logging.getLogger('benchmark_ananke')
+logger.addHandler(logging.NullHandler())
+logger.setLevel(logging.WARNING)
+logger.propagate = False
+
+
+def measure(func, repeat: int = 3) -> tuple:
+    """Best wall time over repeat runs, then the peak traced memory of one more run"""
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def benchmark_kind(kind: str, n_symbols: int, length: int, seed: int, repeat: int) -> list[dict]:
+    """Time every backtest stage on one synthetic universe"""
+    dfs = {symbol: df[['close']].assign(symbol=symbol, signal='')
+           for symbol, df in synthetic.synthetic_universe(n_symbols, length, kind, seed).items()}
+    symbols = list(dfs)
+    candles = n_symbols * length
+    closes = [df['close'].to_numpy() for df in dfs.values()]
+
+    def run_indicators():
+        return [(indicators.rsi(prices, window=14), indicators.macd(prices)) for prices in closes]
+
+    def run_search_entry_point():
+        values = backtest_ananke.batch_indicators(dfs)
+        return {symbol: backtest_ananke.search_entry_point(df, values[symbol]) for symbol, df in dfs.items()}
+
+    signal_dfs = run_search_entry_point()
+
+    def run_simulation():
+        positions, trade_history = backtest.PositionBook(), backtest.TradeLedger()
+        balance, positions, trade_history = backtest.run_portfolio(
+            signal_dfs, symbols, 100.0, positions, trade_history, 0.1, logger)
+        return backtest.close_all_positions(signal_dfs, balance, positions, trade_history, logger)
+
+    balance, _, trade_history = run_simulation()
+
+    def run_metrics():
+        return backtest.calculate_metrics(100.0, balance, trade_history, False, logger)
+
+    results = []
+    for stage, func in (('indicators', run_indicators),
+                        ('search_entry_point', run_search_entry_point),
+                        ('simulation', run_simulation),
+                        ('calculate_metrics', run_metrics)):
+        _, seconds, peak = measure(func, repeat)
+        results.append({
+            'kind': kind,
+            'stage': stage,
+            'symbols': n_symbols,
+            'length': length,
+            'trades': len(trade_history),
+            'seconds': seconds,
+            'candles_per_second': candles / seconds if seconds > 0 else float('inf'),
+            'peak_memory_mb': peak / 2**20
+        })
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Ananke backtest on synthetic klines')
+    parser.add_argument('--symbols', type=int, default=50)
+    parser.add_argument('--length', type=int, default=20000, help='candles per symbol')
+    parser.add_argument('--kinds', nargs='+', default=list(synthetic.KINDS), choices=synthetic.KINDS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args(argv)
+
+    results = []
+    for kind in args.kinds:
+        results += benchmark_kind(kind, args.symbols, args.length, args.seed, args.repeat)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'config': vars(args),
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    table = pd.DataFrame(results).set_index(['kind', 'stage'])
+    print(table[['trades', 'seconds', 'candles_per_second', 'peak_memory_mb']].to_string())
+    return report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,13 +1,45 @@
 import pandas as pd
+import numpy as np
+import time
 import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from binance.spot import Spot
 import settings.indicators
+import settings.signals
 from settings.log import log_message
 from settings.risk import order_size
+from settings.exchange import exchange_info
+from settings.account import AccountState
+from settings.stream import KlineStream
+from settings.buffer import KlineBuffer, KLINE_ARRAYS, kline_arrays, concat_arrays, slice_arrays
+from settings.resample import Resampler, resample_factor
+from settings.metrics import stage_metrics, api_latency
 
 
 unit = 'USDC'
 
+# Concurrent kline requests per iteration (within the connection pool of binance_client)
+kline_workers = 10
+
+# Order rejections that trigger an exchange info refresh (filter failure, invalid symbol)
+EXCHANGE_INFO_ERRORS = (-1013, -1121)
+
+# Stop loss placed with each new position: atr_stop ATRs from the entry, or 10% when 0
+atr_stop = 0
+atr_period = 14
+
+# Closed candles kept per symbol between iterations, and the REST page size
+kline_history = 500
+kline_buffers = {}
+
+# Longer intervals are resampled from the buffered candles of this interval, None to fetch every interval
+base_interval = None
+resamplers = {}
+
+# Streaming indicators per symbol, kept across iterations
+indicator_states = {}
+
 
 def parse_klines(klines):
     """Parse Binance klines to DataFrame"""
@@ -25,107 +57,399 @@ def parse_klines(klines):
     return df.set_index('timestamp')
 
 
-def search_entry_point(klines):
-    df = parse_klines(klines)
-    rsi = settings.indicators.rsi(df['close'].values)[-1]
-    macd = settings.indicators.macd(df['close'].values)
-    if (rsi < 30) and (macd['macd_line'][-1] > macd['signal_line'][-1]) and (macd['macd_line'][-2] <= macd['signal_line'][-2]):
-        df['signal'] = 'BUY'
-    elif (rsi > 70) and (macd['macd_line'][-1] < macd['signal_line'][-1]) and (macd['macd_line'][-2] >= macd['signal_line'][-2]):
-        df['signal'] = 'SELL'
+def latest(candles, column: str):
+    """Last value of a column of search_entry_point's result, arrays or DataFrame"""
+    value = candles[column]
+    if isinstance(value, pd.Series):
+        return value.iloc[-1]
+    if isinstance(value, np.ndarray):
+        return value[-1]
+    return value
+
+
+def update_indicators(symbol: str, candles: dict, interval: str = '5m') -> dict:
+    """Advance the streaming indicators of a symbol and return their last two values.
+
+    candles holds the kline_arrays of the klines. The last one is the candle
+    still forming, so it is only previewed. Closed candles are committed once
+    and never recomputed on later iterations; the state is re-seeded when the
+    stored history no longer overlaps the klines. States are kept per symbol
+    and interval.
+    """
+    open_time, high, low, close = (candles[name] for name in ('timestamp', 'high', 'low', 'close'))
+    n = len(close) - 1
+    state = indicator_states.get((symbol, interval))
+
+    if state is None or n == 0 or open_time[0] > state['open_time']:
+        state = {
+            'open_time': int(open_time[n - 1]) if n else -1,
+            'rsi': settings.indicators.RSI.seed(close[:n]),
+            'macd': settings.indicators.MACD.seed(close[:n]),
+            'atr': settings.indicators.ATR.seed(high[:n], low[:n], close[:n], atr_period)
+        }
+        indicator_states[(symbol, interval)] = state
     else:
-        df['signal'] = ''
-    return df
+        for i in range(np.searchsorted(open_time[:n], state['open_time'], 'right'), n):
+            price = float(close[i])
+            state['rsi'].update(price)
+            state['macd'].update(price)
+            state['atr'].update(float(high[i]), float(low[i]), price)
+            state['open_time'] = int(open_time[i])
+
+    price = float(close[-1])
+    macd_line, signal_line, _ = state['macd'].peek(price)
+    return {
+        'rsi': np.array([state['rsi'].value, state['rsi'].peek(price)]),
+        'macd_line': np.array([state['macd'].macd_line, macd_line]),
+        'signal_line': np.array([state['macd'].signal_line, signal_line]),
+        'atr': state['atr'].peek(float(high[-1]), float(low[-1]), price)
+    }
+
+
+def search_entry_point(klines, symbol: str, interval: str = '5m', as_frame: bool = False):
+    """Signal of the last kline of a symbol, from raw klines or kline_arrays.
+
+    Returns the kline_arrays with the symbol, signal and ATR of the last
+    candle added as plain values, or the parse_klines DataFrame with those
+    columns when as_frame is True.
+    """
+    with stage_metrics.timer('parse_klines'):
+        candles = klines if isinstance(klines, dict) else kline_arrays(klines)
+    with stage_metrics.timer('indicators'):
+        values = update_indicators(symbol, candles, interval)
+    with stage_metrics.timer('signals'):
+        codes = settings.signals.crossover_signals(
+            values['rsi'], values['macd_line'], values['signal_line'])
+    signal = settings.signals.LABELS[int(codes[-1])]
+
+    if as_frame:
+        if isinstance(klines, dict):
+            df = pd.DataFrame({name: candles[name] for name in KLINE_ARRAYS[1:]},
+                              index=pd.to_datetime(candles['timestamp'], unit='ms').rename('timestamp'))
+        else:
+            df = parse_klines(klines)
+        df['symbol'] = symbol
+        df['signal'] = signal
+        atr = np.full(len(df), np.nan)
+        atr[-1] = values['atr']
+        df['atr'] = atr
+        return df
+    candles.update(symbol=symbol, signal=signal, atr=values['atr'])
+    return candles
+
+
+def stop_price(candles, long: bool) -> float:
+    """Stop loss for a new position: atr_stop ATRs from the close, or 10% without an ATR stop"""
+    close = latest(candles, 'close')
+    atr = latest(candles, 'atr') if 'atr' in candles else np.nan
+    if atr_stop and not np.isnan(atr):
+        return close - atr_stop * atr if long else close + atr_stop * atr
+    return close * 0.9 if long else close * 1.1
 
 
-def open_position(client: Spot, df: pd.DataFrame, logger: logging.Logger):
-    signal = df['signal'].iloc[-1]
-    symbol = df['symbol'].iloc[-1]
+def pair_assets(symbol: str) -> tuple:
+    """Base and quote asset of a pair with unit on one side"""
+    if symbol.endswith(unit):
+        return symbol[:-len(unit)], unit
+    return unit, symbol[len(unit):]
+
+
+def open_position(client: Spot, candles, logger: logging.Logger, account: AccountState = None):
+    signal = latest(candles, 'signal')
+    symbol = latest(candles, 'symbol')
+    base, quote = pair_assets(symbol)
     # Open new position
     try:
+        # Balances come from the iteration's snapshot and are updated after each fill
+        account = (account or AccountState(client)).current()
         if signal == 'BUY' and symbol.endswith(unit):
-            size = order_size(client)
+            size = order_size(client, unit, account)
             # Execute buy order
-            client.new_order(
+            order = client.new_order(
                 symbol=symbol,
                 side='BUY',
                 type='MARKET',
                 quoteOrderQty=size
             )
+            account.apply_order(order, base, quote)
             # Set stop loss
             client.new_order(
                 symbol=symbol,
                 side='SELL',
                 type='STOP_LOSS',
-                stopPrice=df['close'].iloc[-1] * 0.9,
+                stopPrice=stop_price(candles, long=True),
                 quantity=size
             )
         elif signal == 'SELL' and symbol.startswith(unit):
-            size = order_size(client)
+            size = order_size(client, unit, account)
             # Execute sell order
-            client.new_order(
+            order = client.new_order(
                 symbol=symbol,
                 side='SELL',
                 type='MARKET',
                 quantity=size
             )
+            account.apply_order(order, base, quote)
             # Set stop loss
             client.new_order(
                 symbol=symbol,
                 side='BUY',
                 type='STOP_LOSS',
-                stopPrice=df['close'].iloc[-1] * 1.1,
+                stopPrice=stop_price(candles, long=False),
                 quoteOrderQty=size
             )
         # Close position
         elif signal == 'SELL' and symbol.endswith(unit):
-            for asset in client.account()['balances']:
-                if asset['asset'] == unit:
-                    balance = float(asset['free'])
-                    break
+            balance = account.free(unit)
             if balance > 0:
-                client.new_order(
+                order = client.new_order(
                     symbol=symbol,
                     side='SELL',
                     type='MARKET',
                     quantity=balance
                 )
+                account.apply_order(order, base, quote)
         elif signal == 'BUY' and symbol.startswith(unit):
-            for asset in client.account()['balances']:
-                if asset['asset'] == unit:
-                    balance = float(asset['free'])
-                    break
+            balance = account.free(unit)
             if balance > 0:
-                client.new_order(
+                order = client.new_order(
                     symbol=symbol,
                     side='BUY',
                     type='MARKET',
                     quoteOrderQty=balance
                 )
+                account.apply_order(order, base, quote)
         else:
             'ok'
     except Exception as e:
+        # Filter failures and unknown symbols mean the cached metadata is outdated
+        if getattr(e, 'error_code', None) in EXCHANGE_INFO_ERRORS:
+            exchange_info(client).invalidate()
         log_message(logger, 'error',
                     f'Error opening position for {symbol}: {e}')
 
 
-def execute_ananke(client: Spot, logger: logging.Logger):
-    # Get exchange information for SPOT trading
+def fetch_klines(client: Spot, symbols: list, interval: str = '5m', max_workers: int = kline_workers,
+                 end_time: int = None):
+    """Fetch klines for many symbols concurrently on a bounded thread pool.
+
+    Yields (symbol, klines, error) as each request completes, so callers can
+    evaluate signals while the remaining requests are still in flight.
+    end_time (ms, exclusive) leaves out the candles opening at or after it.
+    """
+    params = {} if end_time is None else {'endTime': end_time - 1}
+
+    def fetch(symbol):
+        with stage_metrics.timer('kline_fetch'):
+            return client.klines(symbol=symbol, interval=interval, **params)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(fetch, symbol): symbol for symbol in symbols}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def update_buffer(client: Spot, symbol: str, interval: str = '5m', end_time: int = None,
+                  logger: logging.Logger = None) -> tuple:
+    """Top up the kline buffer of a symbol over REST; returns the buffer and the still-forming candles.
+
+    The first call downloads kline_history candles; later ones only ask for
+    the candles opening after the last buffered close, and nothing at all
+    when the buffer already reaches end_time. The buffer is seeded again
+    when the delta does not start right after it (a gap) or when more
+    candles are missing than it holds. Only closed candles are buffered.
+    """
+    buffer = kline_buffers.get((symbol, interval))
+    if buffer is None:
+        buffer = kline_buffers[(symbol, interval)] = KlineBuffer(interval, kline_history)
+    now = end_time if end_time is not None else int(time.time() * 1000)
+    params = {} if end_time is None else {'endTime': end_time - 1}
+    if buffer.count and end_time is not None and buffer.next_open_time >= end_time:
+        return buffer, slice_arrays(buffer.arrays(), slice(0))
+
+    candles = None
+    if buffer.count and (now - buffer.next_open_time) // buffer.step < buffer.size:
+        with stage_metrics.timer('kline_fetch'):
+            klines = client.klines(symbol=symbol, interval=interval, startTime=buffer.next_open_time,
+                                   limit=buffer.size, **params)
+        candles = kline_arrays(klines)
+        if len(candles['timestamp']) and candles['timestamp'][0] != buffer.next_open_time:
+            if logger is not None:
+                log_message(logger, 'warning',
+                            f'Missed {symbol} candles before {candles["timestamp"][0]}, seeding again.')
+            stage_metrics.count('kline_gaps')
+            candles = None
+        else:
+            stage_metrics.count('kline_deltas')
+    if candles is None:
+        buffer.clear()
+        with stage_metrics.timer('kline_fetch'):
+            klines = client.klines(symbol=symbol, interval=interval, limit=buffer.size, **params)
+        candles = kline_arrays(klines)
+        stage_metrics.count('kline_seeds')
+
+    closed = candles['close_time'] < now
+    buffer.append(slice_arrays(candles, closed))
+    return buffer, slice_arrays(candles, ~closed)
+
+
+def buffered_candles(client: Spot, symbol: str, interval: str = '5m', end_time: int = None,
+                     logger: logging.Logger = None, base_interval: str = None) -> dict:
+    """Candles of a symbol to evaluate, the still-forming one last.
+
+    With a base_interval other than interval, the base candles are topped up
+    and resampled into interval candles as they close, so a longer interval
+    costs no request of its own when the base was just fetched.
+    """
+    if base_interval is None or base_interval == interval:
+        buffer, forming = update_buffer(client, symbol, interval, end_time, logger)
+        if len(forming['timestamp']) == 0:
+            return buffer.arrays()
+        return concat_arrays(buffer.arrays(), forming)
+
+    buffer, forming = update_buffer(client, symbol, base_interval, end_time, logger)
+    resampler = resamplers.get((symbol, interval))
+    if resampler is None:
+        if resample_factor(interval, base_interval) >= kline_history:
+            raise ValueError(f'{interval} candles need more than the {kline_history} buffered '
+                             f'{base_interval} candles, fetch {interval} directly or raise kline_history')
+        resampler = resamplers[(symbol, interval)] = Resampler(interval, base_interval, kline_history)
+    with stage_metrics.timer('resample'):
+        resampler.update(buffer.arrays())
+        return resampler.arrays(forming)
+
+
+def fetch_candles(client: Spot, symbols: list, interval: str = '5m', max_workers: int = kline_workers,
+                  end_time: int = None, logger: logging.Logger = None, base_interval: str = None):
+    """Top up the kline buffers of many symbols on a bounded thread pool.
+
+    Yields (symbol, candles, error) as each symbol is ready, like fetch_klines,
+    with candles from buffered_candles.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(buffered_candles, client, symbol, interval, end_time, logger, base_interval): symbol
+                   for symbol in symbols}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def evaluate_symbol(client: Spot, symbol: str, klines, logger: logging.Logger, account: AccountState = None,
+                    interval: str = '5m'):
+    """Search an entry point on the klines of a symbol and trade on a signal"""
+    candles = search_entry_point(klines, symbol, interval)
+    stage_metrics.count('symbols_evaluated')
+    signal = candles['signal']
+    if signal in ['BUY', 'SELL']:
+        log_message(logger, 'info',
+                    f'{signal} signal detected for {symbol}')
+        stage_metrics.count('signals')
+        with stage_metrics.timer('order_placement'):
+            open_position(client, candles, logger, account)
+
+
+def trading_symbols(client: Spot) -> list:
+    # USDC pairs that are trading, from the cached exchange information
+    return exchange_info(client).universe(unit)
+
+
+def execute_ananke(client: Spot, logger: logging.Logger, max_workers: int = kline_workers, interval: str = '5m',
+                   close_time: int = None, base_interval: str = base_interval):
+    """Evaluate every USDC pair once on klines fetched over REST.
+
+    Klines are kept in a buffer per symbol, so after the first iteration
+    only the candles closed since the previous one are downloaded. With a
+    base_interval, interval may be any multiple of it and is resampled from
+    the base candles (see buffered_candles). With close_time (ms, from the
+    candle scheduler) only candles closed by then are fetched, and the
+    just-closed candle is evaluated like the forming one of a free-running
+    poll.
+    """
     try:
-        exchange_info_spot = client.exchange_info(permissions=['SPOT'])
-
-        # Filter for USDC pairs that are trading
-        for symbol in exchange_info_spot['symbols']:
-            if (symbol['quoteAsset'] == unit or symbol['baseAsset'] == unit) and symbol['status'] == 'TRADING':
-                klines = client.klines(
-                    symbol=symbol['symbol'],
-                    interval='5m'
-                )
-                df = search_entry_point(klines)
-                signal = df['signal'].iloc[-1]
-                if signal in ['BUY', 'SELL']:
-                    log_message(logger, 'info',
-                                f'{signal} signal detected for {symbol["symbol"]}')
-                    open_position(client, klines, logger)
+        with stage_metrics.timer('exchange_info'):
+            symbols = trading_symbols(client)
+        # Fetched on the first signal, at most once per iteration
+        account = AccountState(client)
+
+        # Evaluate signals as the klines arrive
+        for symbol, candles, error in fetch_candles(client, symbols, interval, max_workers, close_time, logger,
+                                                     base_interval):
+            if error is not None:
+                log_message(logger, 'error',
+                            f'Error fetching klines for {symbol}: {error}')
+                stage_metrics.count('kline_errors')
+                continue
+            evaluate_symbol(client, symbol, candles, logger, account, interval)
     except Exception as e:
         log_message(logger, 'error', f'Error executing Ananke strategy: {e}')
+
+
+def seed_stream(client: Spot, stream: KlineStream, symbols: list, logger: logging.Logger,
+                max_workers: int = kline_workers):
+    """Fill the stream buffers with REST klines"""
+    # Taken before the requests, so a candle closing while they are in flight is not seeded half-built
+    now = int(time.time() * 1000)
+    for symbol, klines, error in fetch_klines(client, symbols, stream.interval, max_workers):
+        if error is not None:
+            log_message(logger, 'error',
+                        f'Error fetching klines for {symbol}: {error}')
+            continue
+        stream.seed(symbol, klines, now)
+
+
+def run_ananke_stream(client: Spot, logger: logging.Logger, stream_url: str, interval: str = '5m',
+                      max_workers: int = kline_workers, metrics_file: str = None, metrics_every: float = 60):
+    """Run Ananke on kline streams, evaluating each symbol as soon as its candle closes.
+
+    History is downloaded once to seed the buffers; afterwards REST is only
+    used again for symbols whose stream missed candles, or for everything
+    after reconnecting a stream that went quiet for two intervals. With
+    metrics_file, the stage and API latency snapshot is written at most every
+    metrics_every seconds.
+    """
+    stream = KlineStream(stream_url, interval, logger=logger)
+    symbols = trading_symbols(client)
+    # Subscribe first so no candle closes between seeding and streaming
+    stream.start(symbols)
+    seed_stream(client, stream, symbols, logger, max_workers)
+    quiet = 2 * stream.step / 1000
+    # Refetched at most once per candle, on the first signal after it closes
+    account = AccountState(client, max_age=stream.step / 1000)
+    written = time.time()
+
+    try:
+        while True:
+            if metrics_file and time.time() - written >= metrics_every:
+                written = time.time()
+                try:
+                    stage_metrics.write(metrics_file, api_latency)
+                except Exception as e:
+                    log_message(logger, 'error', f'Error writing metrics: {e}')
+
+            try:
+                symbol, candles = stream.closed.get(timeout=5)
+            except queue.Empty:
+                if stream.stale(quiet):
+                    log_message(logger, 'warning',
+                                'Kline streams went quiet, reconnecting.')
+                    stream.restart()
+                    seed_stream(client, stream, symbols, logger, max_workers)
+                elif stream.gaps:
+                    seed_stream(client, stream, sorted(stream.gaps), logger, max_workers)
+                continue
+
+            try:
+                # The just-closed candle is last and is evaluated like the forming one of a REST poll
+                evaluate_symbol(client, symbol, candles, logger, account, stream.interval)
+            except Exception as e:
+                log_message(logger, 'error',
+                            f'Error executing Ananke strategy for {symbol}: {e}')
+    finally:
+        stream.stop()
+        if metrics_file:
+            stage_metrics.write(metrics_file, api_latency)
@@ -1,7 +1,12 @@
-from settings.connect import binance_client
+from settings.connect import binance_client, binance_stream_url
 from settings.log import start_logging, log_message
-from live_ananke import execute_ananke
+from settings.metrics import api_latency, stage_metrics
+from settings.scheduler import CandleScheduler
+from settings.risk import check_ping
+from live_ananke import execute_ananke, run_ananke_stream
 import time
+import sys
+import os
 
 
 # Initialize logging
@@ -9,29 +14,57 @@ logger = start_logging('settings/jupiter')
 log_message(logger, 'info', '   INITIALIZING JUPITER:')
 
 
+# Candle intervals to trade, comma separated (e.g. 1m,5m,1h)
+intervals = os.getenv('JUPITER_INTERVALS', '5m').split(',')
+
+# Interval fetched from Binance and resampled into the longer ones, empty to fetch each interval
+base_interval = os.getenv('JUPITER_BASE_INTERVAL') or None
+
+
+# Metrics snapshot written after every iteration (.json for JSON, else Prometheus textfile)
+metrics_file = os.getenv('JUPITER_METRICS_FILE', 'settings/jupiter_metrics.prom')
+
+
 # Initialize Binance client
 client = binance_client(testnet=True)
 
 
-while True:
+# Streaming mode: evaluate every symbol as its candle closes
+if '--stream' in sys.argv:
+    log_message(logger, 'info', 'Running Ananke on kline streams.')
+    run_ananke_stream(client, logger, binance_stream_url(testnet=True), metrics_file=metrics_file)
+    sys.exit(0)
+
+
+def iteration(interval: str, close_time: int):
     # Ping the Binance API to check latency
     start_time = time.time()
-    client.ping()
-    latency_ms = (time.time() - start_time) * 1000
-    log_message(logger, 'info',
-                f'Iteration starting with {round(latency_ms, 2)} ms latency.')
+    latency_ms = check_ping(client, logger)
+    if latency_ms is not None:
+        log_message(logger, 'info',
+                    f'{interval} iteration starting with {round(latency_ms, 2)} ms latency.')
 
     try:
-        # Execute the ananke strategy
-        execute_ananke(client, logger)
+        # Execute the ananke strategy on the candles closed so far
+        with stage_metrics.timer(f'iteration_{interval}'):
+            execute_ananke(client, logger, interval=interval, close_time=close_time,
+                           base_interval=base_interval)
         log_message(logger, 'info', 'Iteration executed successfully.')
     except Exception as e:
         log_message(logger, 'error',
                     f'Error executing ananke strategy: {e}')
-        break
+        scheduler.stop()
 
-    # Ensure at least 5 minutes between iterations
     finish_time = time.time()
     elapsed_time = finish_time - start_time
     log_message(logger, 'info', f'Elapsed time: {elapsed_time:.2f} seconds.')
-    time.sleep(max(0, 300 - elapsed_time))
+    log_message(logger, 'info', f'Exchange latency by endpoint:\n{api_latency.summary()}')
+    log_message(logger, 'info', f'Stage timings:\n{stage_metrics.timings.summary()}')
+    stage_metrics.write(metrics_file, api_latency)
+
+
+# Wake up shortly after every candle close of each interval
+scheduler = CandleScheduler(client, logger=logger)
+for interval in intervals:
+    scheduler.add(interval, lambda close_time, interval=interval: iteration(interval, close_time))
+scheduler.run()
@@ -0,0 +1,59 @@
+import time
+from binance.spot import Spot
+
+
+class AccountState:
+    """Balances of the account indexed by asset, fetched once and updated locally.
+
+    refresh() downloads the account with a single signed call. Fills are then
+    applied to the snapshot with apply_order() so sizing the next order does
+    not need another call. current() fetches lazily: on first use, and again
+    once the snapshot is older than max_age seconds when max_age is set.
+    """
+
+    def __init__(self, client: Spot, max_age: float = None):
+        self.client = client
+        self.max_age = max_age
+        self.balances = {}
+        self.fetched_at = None
+
+    def refresh(self):
+        account = self.client.account(omitZeroBalances='true')
+        self.balances = {
+            asset['asset']: {'free': float(asset['free']), 'locked': float(asset['locked'])}
+            for asset in account['balances']
+        }
+        self.fetched_at = time.time()
+        return self
+
+    def current(self):
+        if self.fetched_at is None or (self.max_age is not None
+                                       and time.time() - self.fetched_at >= self.max_age):
+            self.refresh()
+        return self
+
+    def free(self, asset: str) -> float:
+        return self.balances.get(asset, {}).get('free', 0.0)
+
+    def locked(self, asset: str) -> float:
+        return self.balances.get(asset, {}).get('locked', 0.0)
+
+    def total(self, asset: str) -> float:
+        return self.free(asset) + self.locked(asset)
+
+    def _add(self, asset: str, amount: float):
+        balance = self.balances.setdefault(asset, {'free': 0.0, 'locked': 0.0})
+        balance['free'] = max(0.0, balance['free'] + amount)
+
+    def apply_order(self, order: dict, base: str, quote: str):
+        """Apply the fills of a new_order response to the free balances"""
+        executed = float(order.get('executedQty', 0))
+        quote_qty = float(order.get('cummulativeQuoteQty', 0))
+        if order.get('side') == 'BUY':
+            self._add(base, executed)
+            self._add(quote, -quote_qty)
+        else:
+            self._add(base, -executed)
+            self._add(quote, quote_qty)
+        for fill in order.get('fills', []):
+            self._add(fill['commissionAsset'], -float(fill['commission']))
@@ -1,210 +1,432 @@
 import pandas as pd
+import numpy as np
+import heapq
 import logging
 import math
+from settings.signals import BUY, SELL, LABELS, signal_codes
+
+
+# Position sides as stored in the position book
+LONG = 1
+SHORT = -1
+SIDES = {LONG: 'LONG', SHORT: 'SHORT'}
+
+# Exit reasons in priority order
+EXIT_REASONS = ('', 'OPPOSITE_SIGNAL', 'TAKE_PROFIT',
+                'TRAILING_STOP', 'TIME_EXIT', 'ATR_STOP')
+
+# Default exit thresholds used when managing positions
+EXIT_RULES = {
+    'take_profit': 0.20,
+    'trailing_stop': 0.15,
+    'max_hold_hours': 48,
+    'atr_stop': 0  # ATR multiple below (LONG) or above (SHORT) the entry, 0 disables it
+}
+
+# Candles in the ATR column of the loaded klines
+ATR_PERIOD = 14
+
+
+# Fill types recorded in the trade ledger
+LEDGER_SIDES = ('OPEN_LONG', 'OPEN_SHORT', 'CLOSE_LONG',
+                'CLOSE_SHORT', 'FORCE_LONG', 'FORCE_SHORT')
+
+LEDGER_DTYPE = np.dtype([
+    ('timestamp', 'datetime64[ns]'),
+    ('symbol', np.int32),   # index into TradeLedger.symbols
+    ('side', np.int8),      # index into LEDGER_SIDES
+    ('reason', np.int8),    # index into EXIT_REASONS
+    ('price', np.float64),
+    ('qty', np.float64),
+    ('usd_flow', np.float64),
+    ('profit', np.float64),
+    ('balance', np.float64)
+])
+
+
+class TradeLedger:
+    """Growable columnar record of every fill, with a fixed schema.
+
+    Rows live in a preallocated structured array (LEDGER_DTYPE) that doubles
+    when full. Fields a fill does not have (profit on opens, qty on exits)
+    are NaN, like the missing keys of the old per-fill dicts.
+    """
+
+    __slots__ = ('rows', 'size', 'symbols', '_symbol_ids')
+
+    _side_ids = {side: i for i, side in enumerate(LEDGER_SIDES)}
+    _reason_ids = {reason: i for i, reason in enumerate(EXIT_REASONS)}
+
+    def __init__(self, capacity: int = 1024):
+        self.rows = np.zeros(max(capacity, 1), dtype=LEDGER_DTYPE)
+        self.size = 0
+        self.symbols = []
+        self._symbol_ids = {}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.rows[column][:self.size]
+
+    def _symbol_id(self, symbol: str) -> int:
+        symbol_id = self._symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self._symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return symbol_id
+
+    def _reserve(self, extra: int):
+        if self.size + extra > len(self.rows):
+            rows = np.zeros(max(2 * len(self.rows), self.size + extra),
+                            dtype=LEDGER_DTYPE)
+            rows[:self.size] = self.rows[:self.size]
+            self.rows = rows
+
+    def append(self, timestamp: pd.Timestamp, symbol: str, side: str, price: float, qty: float = np.nan,
+               usd_flow: float = np.nan, profit: float = np.nan, balance: float = np.nan, reason: str = ''):
+        self._reserve(1)
+        self.rows[self.size] = (pd.Timestamp(timestamp).value, self._symbol_id(symbol), self._side_ids[side],
+                                self._reason_ids[reason], price, qty, usd_flow, profit, balance)
+        self.size += 1
+
+    def to_frame(self) -> pd.DataFrame:
+        """Readable DataFrame of the fills, with symbol, side and reason labels"""
+        rows = self.rows[:self.size]
+        return pd.DataFrame({
+            'timestamp': rows['timestamp'],
+            'symbol': np.array(self.symbols, dtype=object)[rows['symbol']] if self.symbols else np.array([], dtype=object),
+            'side': np.array(LEDGER_SIDES, dtype=object)[rows['side']],
+            'price': rows['price'],
+            'qty': rows['qty'],
+            'usd_flow': rows['usd_flow'],
+            'profit': rows['profit'],
+            'balance': rows['balance'],
+            'reason': np.array(EXIT_REASONS, dtype=object)[rows['reason']]
+        })
 
 
-def open_position(kline: pd.DataFrame, balance: float, positions: dict, trade_history: list, risk_per_trade: float, logger: logging.Logger):
+class PositionBook:
+    """Open positions held as typed arrays, one slot per symbol.
+
+    Each array is indexed by the slot of a symbol. A slot is flat when its
+    side is 0; open slots are also kept in the order they were opened so that
+    positions are managed and force-closed in the same order as before.
+    """
+
+    __slots__ = ('slots', 'symbols', 'side', 'qty', 'usd_in',
+                 'entry_price', 'entry_time', 'extreme', '_open')
+
+    def __init__(self, symbols: list = (), capacity: int = 64):
+        self.slots = {}
+        self.symbols = []
+        size = max(capacity, len(symbols), 1)
+        self.side = np.zeros(size, dtype=np.int8)
+        self.qty = np.zeros(size)
+        self.usd_in = np.zeros(size)
+        self.entry_price = np.zeros(size)
+        self.entry_time = np.zeros(size, dtype=np.int64)  # ns since epoch
+        self.extreme = np.full(size, np.nan)  # highest (LONG) or lowest (SHORT) price seen
+        self._open = {}
+        for symbol in symbols:
+            self.slot(symbol)
+
+    def slot(self, symbol: str) -> int:
+        """Slot of a symbol, assigned on first use"""
+        slot = self.slots.get(symbol)
+        if slot is None:
+            slot = len(self.symbols)
+            if slot == len(self.side):
+                self._grow()
+            self.slots[symbol] = slot
+            self.symbols.append(symbol)
+        return slot
+
+    def _grow(self):
+        size = 2 * len(self.side)
+        for name in ('side', 'qty', 'usd_in', 'entry_price', 'entry_time', 'extreme'):
+            old = getattr(self, name)
+            new = np.full(size, np.nan) if name == 'extreme' else np.zeros(
+                size, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def __contains__(self, symbol: str) -> bool:
+        slot = self.slots.get(symbol)
+        return slot is not None and slot in self._open
+
+    def __len__(self) -> int:
+        return len(self._open)
+
+    def __iter__(self):
+        return iter([self.symbols[slot] for slot in self._open])
+
+    def open_slots(self) -> list:
+        """Slots of open positions in the order they were opened"""
+        return list(self._open)
+
+    def open(self, symbol: str, side: int, usd_in: float, qty: float, price: float, entry_time: int) -> int:
+        slot = self.slot(symbol)
+        self.side[slot] = side
+        self.usd_in[slot] = usd_in
+        self.qty[slot] = qty
+        self.entry_price[slot] = price
+        self.entry_time[slot] = entry_time
+        self.extreme[slot] = np.nan
+        self._open[slot] = None
+        return slot
+
+    def close(self, slot: int):
+        self.side[slot] = 0
+        self._open.pop(slot, None)
+
+
+def open_position(kline: pd.DataFrame, balance: float, positions: PositionBook, trade_history: TradeLedger, risk_per_trade: float, logger: logging.Logger):
     signal = kline['signal'].iat[0]
     symbol = kline['symbol'].iat[0]
     price = float(kline['close'].iat[0])
     timestamp = kline.index[0]
+    return open_position_at(symbol, signal, price, timestamp, balance, positions, trade_history, risk_per_trade, logger)
 
-    # OPEN LONG POSITION
-    if signal == 'BUY' and symbol not in positions:
-        max_invest = risk_per_trade * balance
-        if max_invest < 0.01:  # Minimum trade size check
-            return balance, positions, trade_history
-
-        qty = max_invest / price
-        positions[symbol] = {
-            'side': 'LONG',
-            'usd_in': max_invest,
-            'qty': qty,
-            'entry_price': price,
-            'entry_time': timestamp
-        }
-        balance -= max_invest
-        logger.info(
-            f"{timestamp} OPEN LONG: {symbol} @ {price:.2f} | "
-            f"Invested={max_invest:.4f} qty={qty:.8f} balance={balance:.4f}")
-
-        trade_history.append({
-            'timestamp': timestamp,
-            'symbol': symbol,
-            'side': 'OPEN_LONG',
-            'price': price,
-            'qty': qty,
-            'usd_flow': -max_invest,
-            'balance': balance
-        })
 
-    # OPEN SHORT POSITION
-    elif signal == 'SELL' and symbol not in positions:
-        max_invest = risk_per_trade * balance
-        if max_invest < 0.01:  # Minimum trade size check
-            return balance, positions, trade_history
-
-        qty = max_invest / price
-        positions[symbol] = {
-            'side': 'SHORT',
-            'usd_in': max_invest,
-            'qty': qty,
-            'entry_price': price,
-            'entry_time': timestamp
-        }
-        balance -= max_invest
-        logger.info(
-            f"{timestamp} OPEN SHORT: {symbol} @ {price:.2f} | "
-            f"Invested={max_invest:.4f} qty={qty:.8f} balance={balance:.4f}")
-
-        trade_history.append({
-            'timestamp': timestamp,
-            'symbol': symbol,
-            'side': 'OPEN_SHORT',
-            'price': price,
-            'qty': qty,
-            'usd_flow': -max_invest,
-            'balance': balance
-        })
+def open_position_at(symbol: str, signal: str, price: float, timestamp: pd.Timestamp, balance: float, positions: PositionBook, trade_history: TradeLedger, risk_per_trade: float, logger: logging.Logger):
+    """Open a position from plain candle values, without a one-row DataFrame"""
+    if signal not in ('BUY', 'SELL') or symbol in positions:
+        return balance, positions, trade_history
 
-    return balance, positions, trade_history
+    max_invest = risk_per_trade * balance
+    if max_invest < 0.01:  # Minimum trade size check
+        return balance, positions, trade_history
 
+    # OPEN LONG on BUY, OPEN SHORT on SELL
+    side = LONG if signal == 'BUY' else SHORT
+    qty = max_invest / price
+    positions.open(symbol, side, max_invest, qty, price, timestamp.value)
+    balance -= max_invest
+    logger.info(
+        f"{timestamp} OPEN {SIDES[side]}: {symbol} @ {price:.2f} | "
+        f"Invested={max_invest:.4f} qty={qty:.8f} balance={balance:.4f}")
 
-def should_close_position(position, current_time, max_hold_hours=24):
-    """Close position after maximum hold time"""
-    hold_time_hours = (
-        current_time - position['entry_time']).total_seconds() / 3600
-    return hold_time_hours >= max_hold_hours
+    trade_history.append(timestamp, symbol, f'OPEN_{SIDES[side]}', price,
+                         qty=qty, usd_flow=-max_invest, balance=balance)
 
+    return balance, positions, trade_history
 
-def trailing_stop_loss(position, current_price, trail_percent=0.15):
-    """Trailing stop loss that follows price upward"""
-    if position['side'] == 'LONG':
-        # Update highest price seen
-        if 'highest_price' not in position:
-            position['highest_price'] = current_price
-        else:
-            position['highest_price'] = max(
-                position['highest_price'], current_price)
-
-        # Check if current price is below trail threshold
-        stop_price = position['highest_price'] * (1 - trail_percent)
-        return current_price <= stop_price
 
-    elif position['side'] == 'SHORT':
-        # Update lowest price seen
-        if 'lowest_price' not in position:
-            position['lowest_price'] = current_price
-        else:
-            position['lowest_price'] = min(
-                position['lowest_price'], current_price)
+def should_close_position(positions: PositionBook, slots: np.ndarray, current_time: int, max_hold_hours=24) -> np.ndarray:
+    """Close positions after maximum hold time"""
+    hold_time_hours = (
+        current_time - positions.entry_time[slots]) / 1e9 / 3600
+    return hold_time_hours >= max_hold_hours
 
-        # Check if current price is above trail threshold
-        stop_price = position['lowest_price'] * (1 + trail_percent)
-        return current_price >= stop_price
 
+def trailing_stop_loss(positions: PositionBook, slots: np.ndarray, current_price: np.ndarray, trail_percent=0.15) -> np.ndarray:
+    """Trailing stop loss that follows price upward (LONG) or downward (SHORT)"""
+    long = positions.side[slots] == LONG
 
-def take_profit_target(position, current_price, profit_percent=0.20):
-    """Close position when reaching profit target"""
-    if position['side'] == 'LONG':
-        profit_pct = (current_price -
-                      position['entry_price']) / position['entry_price']
-        return profit_pct >= profit_percent
+    # Update highest price seen for longs and lowest price seen for shorts
+    extreme = np.where(long,
+                       np.fmax(positions.extreme[slots], current_price),
+                       np.fmin(positions.extreme[slots], current_price))
+    positions.extreme[slots] = extreme
 
-    elif position['side'] == 'SHORT':
-        profit_pct = (position['entry_price'] -
-                      current_price) / position['entry_price']
-        return profit_pct >= profit_percent
+    # Check if current price crossed the trail threshold
+    return np.where(long,
+                    current_price <= extreme * (1 - trail_percent),
+                    current_price >= extreme * (1 + trail_percent))
 
 
-def opposite_signal_exit(position, current_signal):
-    """Close position when opposite signal appears"""
-    if position['side'] == 'LONG' and current_signal == 'SELL':
-        return True
-    elif position['side'] == 'SHORT' and current_signal == 'BUY':
-        return True
-    return False
+def take_profit_target(positions: PositionBook, slots: np.ndarray, current_price: np.ndarray, profit_percent=0.20) -> np.ndarray:
+    """Close positions when reaching profit target"""
+    entry_price = positions.entry_price[slots]
+    profit_pct = np.where(positions.side[slots] == LONG,
+                          (current_price - entry_price) / entry_price,
+                          (entry_price - current_price) / entry_price)
+    return profit_pct >= profit_percent
 
 
-def volatility_stop(position, current_price, df, atr_period=14, atr_multiplier=2):
-    """Stop loss based on volatility (ATR)"""
-    # Calculate ATR (Average True Range)
-    high_low = df['high'] - df['low']
-    high_close = abs(df['high'] - df['close'].shift(1))
-    low_close = abs(df['low'] - df['close'].shift(1))
-    true_range = pd.concat(
-        [high_low, high_close, low_close], axis=1).max(axis=1)
-    atr = true_range.rolling(atr_period).mean().iloc[-1]
+def opposite_signal_exit(positions: PositionBook, slots: np.ndarray, current_signal: np.ndarray) -> np.ndarray:
+    """Close positions when opposite signal appears"""
+    side = positions.side[slots]
+    return ((side == LONG) & (current_signal == SELL)) | ((side == SHORT) & (current_signal == BUY))
 
-    if position['side'] == 'LONG':
-        stop_price = position['entry_price'] - (atr * atr_multiplier)
-        return current_price <= stop_price
 
-    elif position['side'] == 'SHORT':
-        stop_price = position['entry_price'] + (atr * atr_multiplier)
-        return current_price >= stop_price
+def volatility_stop(positions: PositionBook, slots: np.ndarray, current_price: np.ndarray, current_atr: np.ndarray, atr_multiplier=2) -> np.ndarray:
+    """Stop loss based on volatility (ATR of the current candle)"""
+    entry_price = positions.entry_price[slots]
+    return np.where(positions.side[slots] == LONG,
+                    current_price <= entry_price - (current_atr * atr_multiplier),
+                    current_price >= entry_price + (current_atr * atr_multiplier))
 
 
-def manage_positions(kline: pd.DataFrame, balance: float, positions: dict, trade_history: list, logger: logging.Logger):
+def exit_reasons(positions: PositionBook, slots: np.ndarray, current_signal: np.ndarray, current_price: np.ndarray, current_time: int, exit_rules: dict = None, current_atr: np.ndarray = None) -> np.ndarray:
+    """Index into EXIT_REASONS of the first exit rule hit by each position (0 to hold)"""
+    rules = {**EXIT_RULES, **(exit_rules or {})}
+    checks = [
+        # 1. Opposite signal exit
+        opposite_signal_exit(positions, slots, current_signal),
+        # 2. Take profit (20% by default)
+        take_profit_target(positions, slots, current_price,
+                           rules['take_profit']),
+        # 3. Trailing stop loss (15% by default)
+        trailing_stop_loss(positions, slots, current_price,
+                           rules['trailing_stop']),
+        # 4. Time-based exit (48 hours max by default)
+        should_close_position(positions, slots, current_time,
+                              rules['max_hold_hours'])
+    ]
+    # 5. ATR stop, when selected
+    if rules['atr_stop']:
+        if current_atr is None:
+            raise ValueError('The ATR stop needs an atr column')
+        checks.append(volatility_stop(positions, slots, current_price,
+                                      current_atr, rules['atr_stop']))
+
+    # Apply the lowest priority first so higher priorities overwrite it
+    reasons = np.zeros(len(slots), dtype=np.int8)
+    for reason in range(len(checks), 0, -1):
+        reasons[checks[reason - 1]] = reason
+    return reasons
+
+
+def solve_exit(times: np.ndarray, closes: np.ndarray, codes: np.ndarray, start: int, side: int, entry_price: float,
+               entry_time: int, extreme: float = np.nan, exit_rules: dict = None, opposite_rows: np.ndarray = None,
+               chunk: int = 256, atr: np.ndarray = None) -> tuple:
+    """First candle from start on where a position exits, found with array searches.
+
+    Gives the same answer as running exit_reasons candle by candle: the
+    opposite signal comes from a search in the rows carrying it, the time exit
+    from a search in the candle times, and take profit and the trailing stop
+    (along with the ATR stop when selected) from a running max/min scanned in
+    growing chunks only up to the earlier of those two. Returns (row, reason,
+    extreme), with row -1 and reason 0 when the position survives the data,
+    and extreme the highest (LONG) or lowest (SHORT) price seen up to the exit
+    row or the last candle.
+    """
+    rules = {**EXIT_RULES, **(exit_rules or {})}
+    n = len(times)
+    if start >= n:
+        return -1, 0, extreme
+    long = side == LONG
+    if rules['atr_stop'] and atr is None:
+        raise ValueError('The ATR stop needs an atr column')
+
+    # 1. Opposite signal
+    if opposite_rows is None:
+        opposite_rows = np.flatnonzero(codes == (SELL if long else BUY))
+    k = np.searchsorted(opposite_rows, start)
+    opposite_row = int(opposite_rows[k]) if k < len(opposite_rows) else n
+
+    # 4. Time exit, checked with the same expression as should_close_position
+    def held_too_long(rows):
+        return (times[rows] - entry_time) / 1e9 / 3600 >= rules['max_hold_hours']
+
+    time_row = n
+    hold_ns = rules['max_hold_hours'] * 3600 * 1e9
+    if hold_ns < 2**62:
+        lo = max(start, int(np.searchsorted(times, entry_time + int(hold_ns))) - 1)
+        while lo < n:
+            hi = min(n, lo + 4)
+            hits = np.flatnonzero(held_too_long(np.arange(lo, hi)))
+            if len(hits):
+                time_row = lo + int(hits[0])
+                break
+            lo = hi
+
+    # 2., 3. and 5. Take profit, trailing and ATR stops, up to the first of the other exits
+    bound = min(opposite_row, time_row, n - 1)
+    accumulate = np.fmax.accumulate if long else np.fmin.accumulate
+    pos = start
+    while pos <= bound:
+        end = min(bound + 1, pos + chunk)
+        price = closes[pos:end]
+        running = accumulate(np.concatenate(([extreme], price)))[1:]
+        atr_stop = np.zeros(len(price), dtype=bool)
+        if long:
+            take_profit = (price - entry_price) / entry_price >= rules['take_profit']
+            trailing = price <= running * (1 - rules['trailing_stop'])
+            if rules['atr_stop']:
+                atr_stop = price <= entry_price - (atr[pos:end] * rules['atr_stop'])
+        else:
+            take_profit = (entry_price - price) / entry_price >= rules['take_profit']
+            trailing = price >= running * (1 + rules['trailing_stop'])
+            if rules['atr_stop']:
+                atr_stop = price >= entry_price + (atr[pos:end] * rules['atr_stop'])
+        hit = np.flatnonzero(take_profit | trailing | atr_stop)
+        if len(hit):
+            i = int(hit[0])
+            row = pos + i
+            checks = (row == opposite_row, take_profit[i], trailing[i], held_too_long(row), atr_stop[i])
+            return row, checks.index(True) + 1, float(running[i])
+        extreme = float(running[-1])
+        pos = end
+        chunk *= 2
+
+    row = min(opposite_row, time_row)
+    if row >= n:
+        return -1, 0, extreme
+    return row, 1 if row == opposite_row else EXIT_REASONS.index('TIME_EXIT'), extreme
+
+
+def manage_positions(kline: pd.DataFrame, balance: float, positions: PositionBook, trade_history: TradeLedger, logger: logging.Logger, exit_rules: dict = None):
     """Manage all open positions for current candle"""
 
     symbol = kline['symbol'].iloc[0]
     current_price = float(kline['close'].iloc[0])
     current_time = kline.index[0]
     current_signal = kline['signal'].iloc[0]
+    current_atr = float(kline['atr'].iloc[0]) if 'atr' in kline else None
+    return manage_position_at(symbol, current_signal, current_price, current_time, balance, positions, trade_history, logger, exit_rules, current_atr)
 
-    for sym, pos in list(positions.items()):
-        if sym != symbol:
-            continue
 
-        close_position = False
-        close_reason = ""
+def manage_position_at(symbol: str, current_signal: str, current_price: float, current_time: pd.Timestamp, balance: float, positions: PositionBook, trade_history: TradeLedger, logger: logging.Logger, exit_rules: dict = None, current_atr: float = None):
+    """Manage the open position of a symbol from plain candle values"""
+    if symbol not in positions:
+        return balance, positions, trade_history
+    return manage_slots(np.array([positions.slot(symbol)]), signal_codes(np.array([current_signal], dtype=object)),
+                        np.array([current_price]), current_time, balance, positions, trade_history, logger, exit_rules,
+                        None if current_atr is None else np.array([current_atr]))
+
+
+def manage_slots(slots: np.ndarray, current_signal: np.ndarray, current_price: np.ndarray, current_time: pd.Timestamp, balance: float, positions: PositionBook, trade_history: TradeLedger, logger: logging.Logger, exit_rules: dict = None, current_atr: np.ndarray = None):
+    """Run the exit checks of several open positions sharing one candle time at once.
+
+    slots must be in the order the positions were opened.
+    """
+    reasons = exit_reasons(positions, slots, current_signal,
+                           current_price, current_time.value, exit_rules, current_atr)
+    return close_slots(slots, reasons, current_price, current_time, balance, positions, trade_history, logger)
+
+
+def close_slots(slots: np.ndarray, reasons: np.ndarray, current_price: np.ndarray, current_time: pd.Timestamp, balance: float, positions: PositionBook, trade_history: TradeLedger, logger: logging.Logger):
+    """Close the positions whose reason (index into EXIT_REASONS) is not 0, in slot order"""
+    for i in np.flatnonzero(reasons):
+        slot = slots[i]
+        sym = positions.symbols[slot]
+        side = SIDES[int(positions.side[slot])]
+        qty = float(positions.qty[slot])
+        usd_in = float(positions.usd_in[slot])
+        price = float(current_price[i])
+        close_reason = EXIT_REASONS[reasons[i]]
+
+        # Close the position
+        if side == 'LONG':
+            proceeds = qty * price
+            profit = proceeds - usd_in
+            balance += proceeds
+        else:  # SHORT
+            proceeds = qty * float(positions.entry_price[slot])
+            current_value = qty * price
+            profit = proceeds - current_value
+            balance += proceeds - current_value + usd_in
 
-        # 1. Opposite signal exit
-        if opposite_signal_exit(pos, current_signal):
-            close_position = True
-            close_reason = "OPPOSITE_SIGNAL"
-
-        # 2. Take profit (20%)
-        elif take_profit_target(pos, current_price, 0.20):
-            close_position = True
-            close_reason = "TAKE_PROFIT"
-
-        # 3. Trailing stop loss (15%)
-        elif trailing_stop_loss(pos, current_price, 0.15):
-            close_position = True
-            close_reason = "TRAILING_STOP"
-
-        # 4. Time-based exit (48 hours max)
-        elif should_close_position(pos, current_time, 48):
-            close_position = True
-            close_reason = "TIME_EXIT"
-
-        if close_position:
-            # Close the position
-            if pos['side'] == 'LONG':
-                proceeds = pos['qty'] * current_price
-                profit = proceeds - pos['usd_in']
-                balance += proceeds
-            else:  # SHORT
-                proceeds = pos['qty'] * pos['entry_price']
-                current_value = pos['qty'] * current_price
-                profit = proceeds - current_value
-                balance += proceeds - current_value + pos['usd_in']
-
-            logger.info(f"{kline.index[0]} CLOSE {pos['side']}: {sym} @ {current_price:.2f} | "
-                        f"Profit: {profit:.4f} ({close_reason})")
-
-            trade_history.append({
-                'timestamp': current_time,
-                'symbol': sym,
-                'side': f'CLOSE_{pos["side"]}',
-                'price': current_price,
-                'profit': profit,
-                'reason': close_reason
-            })
-
-            del positions[sym]
+        logger.info(f"{current_time} CLOSE {side}: {sym} @ {price:.2f} | "
+                    f"Profit: {profit:.4f} ({close_reason})")
+
+        trade_history.append(current_time, sym, f'CLOSE_{side}', price,
+                             profit=profit, reason=close_reason)
+
+        positions.close(slot)
 
     return balance, positions, trade_history
 
@@ -212,8 +434,8 @@ def manage_positions(kline: pd.DataFrame, balance: float, positions: dict, trade
 def close_all_positions(
     dfs: dict[str, pd.DataFrame],
     balance: float,
-    positions: dict,
-    trade_history: list,
+    positions: PositionBook,
+    trade_history: TradeLedger,
     logger: logging.Logger
 ):
     """Force-close all open positions at last known price (per symbol in dfs)."""
@@ -221,7 +443,8 @@ def close_all_positions(
     if not positions:
         return balance, positions, trade_history
 
-    for sym, pos in list(positions.items()):
+    for slot in positions.open_slots():
+        sym = positions.symbols[slot]
         if sym not in dfs or dfs[sym].empty:
             logger.warning(f"No data found for {sym}, skipping force-close.")
             continue
@@ -230,57 +453,41 @@ def close_all_positions(
         last_row = dfs[sym].iloc[-1]
         price = float(last_row['close'])
         timestamp = last_row.name
+        qty = float(positions.qty[slot])
+        usd_in = float(positions.usd_in[slot])
 
-        if pos['side'] == 'LONG':
-            qty = pos['qty']
+        if positions.side[slot] == LONG:
             proceeds = qty * price
-            profit = proceeds - pos['usd_in']
+            profit = proceeds - usd_in
             balance += proceeds
             logger.info(
                 f"{timestamp} FORCE CLOSE LONG: {sym} @ {price:.2f} | "
                 f"Profit={profit:.4f} balance={balance:.4f}"
             )
 
-            trade_history.append({
-                'timestamp': timestamp,
-                'symbol': sym,
-                'side': 'FORCE_LONG',
-                'price': price,
-                'qty': qty,
-                'usd_flow': proceeds,
-                'profit': profit,
-                'balance': balance
-            })
-
-        elif pos['side'] == 'SHORT':
-            qty = pos['qty']
-            proceeds = qty * pos['entry_price']
+            trade_history.append(timestamp, sym, 'FORCE_LONG', price, qty=qty,
+                                 usd_flow=proceeds, profit=profit, balance=balance)
+
+        elif positions.side[slot] == SHORT:
+            proceeds = qty * float(positions.entry_price[slot])
             current_value = qty * price
             profit = proceeds - current_value
-            balance += proceeds - current_value + pos['usd_in']
+            balance += proceeds - current_value + usd_in
             logger.info(
                 f"{timestamp} FORCE CLOSE SHORT: {sym} @ {price:.2f} | "
                 f"Profit={profit:.4f} balance={balance:.4f}"
             )
 
-            trade_history.append({
-                'timestamp': timestamp,
-                'symbol': sym,
-                'side': 'FORCE_SHORT',
-                'price': price,
-                'qty': qty,
-                'usd_flow': proceeds - current_value,
-                'profit': profit,
-                'balance': balance
-            })
+            trade_history.append(timestamp, sym, 'FORCE_SHORT', price, qty=qty,
+                                 usd_flow=proceeds - current_value, profit=profit, balance=balance)
 
         # Remove closed position
-        del positions[sym]
+        positions.close(slot)
 
     return balance, positions, trade_history
 
 
-def calculate_metrics(initial_balance: float, balance: float, trade_history: list, log_metrics: bool, logger: logging.Logger) -> dict:
+def calculate_metrics(initial_balance: float, balance: float, trade_history: TradeLedger, log_metrics: bool, logger: logging.Logger) -> dict:
     """Calculate performance metrics from trade history with optional logging"""
     # Initialize metrics with default values
     metrics = {
@@ -304,60 +511,47 @@ def calculate_metrics(initial_balance: float, balance: float, trade_history: lis
         return metrics
 
     try:
-        df_trades = pd.DataFrame(trade_history)
-        closed_trades = df_trades.dropna(subset=['profit'])
+        profit = trade_history['profit']
+        closed = ~np.isnan(profit)
 
-        if closed_trades.empty:
+        if not closed.any():
             if log_metrics:
                 logger.info(
                     "No closed trades available for metrics calculation")
             return metrics
 
-        metrics['num_trades'] = len(closed_trades)
+        metrics['num_trades'] = int(closed.sum())
 
         # Win rate
-        winning_trades = closed_trades[closed_trades['profit'] > 0]
-        losing_trades = closed_trades[closed_trades['profit'] <= 0]
+        winning_trades = profit[closed & (profit > 0)]
+        losing_trades = profit[closed & (profit <= 0)]
 
         metrics['win_rate'] = len(winning_trades) / metrics['num_trades'] * 100
 
         # Profit factor
-        metrics['gross_profit'] = winning_trades['profit'].sum()
-        metrics['gross_loss'] = abs(losing_trades['profit'].sum())
+        metrics['gross_profit'] = winning_trades.sum()
+        metrics['gross_loss'] = abs(losing_trades.sum())
         metrics['profit_factor'] = metrics['gross_profit'] / \
             metrics['gross_loss'] if metrics['gross_loss'] > 0 else math.inf
 
         # Average win/loss
-        metrics['avg_win'] = winning_trades['profit'].mean(
-        ) if not winning_trades.empty else 0
-        metrics['avg_loss'] = losing_trades['profit'].mean(
-        ) if not losing_trades.empty else 0
+        metrics['avg_win'] = winning_trades.mean() if len(winning_trades) else 0
+        metrics['avg_loss'] = losing_trades.mean() if len(losing_trades) else 0
 
         # Largest win/loss
-        metrics['largest_win'] = winning_trades['profit'].max(
-        ) if not winning_trades.empty else 0
-        metrics['largest_loss'] = losing_trades['profit'].min(
-        ) if not losing_trades.empty else 0
+        metrics['largest_win'] = winning_trades.max() if len(winning_trades) else 0
+        metrics['largest_loss'] = losing_trades.min() if len(losing_trades) else 0
 
         # Max drawdown
-        df_trades['cumulative'] = df_trades['profit'].fillna(
-            0).cumsum() + initial_balance
-        df_trades['peak'] = df_trades['cumulative'].cummax()
-        df_trades['drawdown'] = (
-            df_trades['cumulative'] - df_trades['peak']) / df_trades['peak']
-        metrics['max_drawdown'] = df_trades['drawdown'].min() * 100
-
-        # Additional metrics if available
-        if 'side' in df_trades.columns:
-            metrics['long_trades'] = len(
-                df_trades[df_trades['side'].str.contains('LONG', na=False)])
-            metrics['short_trades'] = len(
-                df_trades[df_trades['side'].str.contains('SHORT', na=False)])
-
-        if 'entry_time' in df_trades.columns and 'exit_time' in df_trades.columns:
-            df_trades['duration'] = (
-                df_trades['exit_time'] - df_trades['entry_time']).dt.total_seconds() / 3600
-            metrics['avg_trade_duration'] = df_trades['duration'].mean()
+        cumulative = np.cumsum(np.where(closed, profit, 0)) + initial_balance
+        peak = np.maximum.accumulate(cumulative)
+        metrics['max_drawdown'] = ((cumulative - peak) / peak).min() * 100
+
+        # Long/short fill counts
+        sides = trade_history['side']
+        long_sides = [i for i, side in enumerate(LEDGER_SIDES) if 'LONG' in side]
+        metrics['long_trades'] = int(np.isin(sides, long_sides).sum())
+        metrics['short_trades'] = len(sides) - metrics['long_trades']
 
         # Log metrics if requested
         if log_metrics:
@@ -380,10 +574,6 @@ def calculate_metrics(initial_balance: float, balance: float, trade_history: lis
                 logger.info("Long Trades: %d", metrics['long_trades'])
                 logger.info("Short Trades: %d", metrics['short_trades'])
 
-            if 'avg_trade_duration' in metrics:
-                logger.info("Avg Trade Duration: %.2f hours",
-                            metrics['avg_trade_duration'])
-
     except Exception as e:
         logger.error("Error calculating metrics: %s", str(e))
         if log_metrics:
@@ -392,9 +582,133 @@ def calculate_metrics(initial_balance: float, balance: float, trade_history: lis
     return metrics
 
 
-def create_unified_timeline(pairs_data: dict):
-    """Create a master timeline from all pairs"""
-    all_timestamps = set()
-    for symbol, df in pairs_data.items():
-        all_timestamps.update(df.index)
-    return sorted(all_timestamps)
+def portfolio_arrays(dfs: dict[str, pd.DataFrame], symbol_order: list):
+    """Per-symbol candle times (ns), closes and signal codes for simulate_portfolio.
+
+    Symbols in symbol_order that have data come first, in that order; the
+    remaining symbols of dfs follow and can only manage positions.
+    Returns (symbols, can_open, times, closes, codes).
+    """
+    symbols = [s for s in dict.fromkeys(symbol_order) if s in dfs]
+    can_open = len(symbols)
+    symbols += [s for s in dfs if s not in set(symbols)]
+
+    times, closes, codes = [], [], []
+    for symbol in symbols:
+        df = dfs[symbol]
+        times.append(np.asarray(df.index, dtype='datetime64[ns]').view('int64'))
+        closes.append(df['close'].to_numpy(dtype=float))
+        codes.append(signal_codes(df['signal'].to_numpy(dtype=object)))
+    return symbols, can_open, times, closes, codes
+
+
+def run_portfolio(dfs: dict[str, pd.DataFrame], symbol_order: list, balance: float, positions: PositionBook, trade_history: TradeLedger, risk_per_trade: float, logger: logging.Logger, exit_rules: dict = None):
+    """Event-driven portfolio backtest over pre-sorted per-symbol candles.
+
+    Signal candles of every symbol are merged into one time-ordered stream, and
+    symbols holding a position advance an integer cursor through their own
+    candles via a heap keyed on the next candle time. Only symbols with a candle
+    at the current time are visited, in the same order as a walk over the
+    unified timeline: new signals in symbol_order first, then open positions in
+    the order they were opened.
+    """
+    symbols, can_open, times, closes, codes = portfolio_arrays(dfs, symbol_order)
+    atrs = [dfs[symbol]['atr'].to_numpy(dtype=float) if 'atr' in dfs[symbol] else None
+            for symbol in symbols]
+    return simulate_portfolio(symbols, can_open, times, closes, codes, balance, positions,
+                              trade_history, risk_per_trade, logger, exit_rules, atrs)
+
+
+def simulate_portfolio(symbols: list, can_open: int, times: list, closes: list, codes: list, balance: float, positions: PositionBook, trade_history: TradeLedger, risk_per_trade: float, logger: logging.Logger, exit_rules: dict = None, atrs: list = None):
+    """run_portfolio on prepared arrays (see portfolio_arrays), with optional ATR arrays for the ATR stop.
+
+    The exit of every position is solved with solve_exit as soon as it opens,
+    so the loop only visits signal candles and exits and its cost follows the
+    number of trades, not the number of candles held.
+    """
+    rank_of_slot = {positions.slot(symbol): rank for rank,
+                    symbol in enumerate(symbols)}
+
+    event_times, event_ranks, event_rows = [], [], []
+    for rank in range(can_open):
+        rows = np.flatnonzero(codes[rank])
+        event_times.append(times[rank][rows])
+        event_ranks.append(np.full(len(rows), rank))
+        event_rows.append(rows)
+
+    # k-way merge of the signal candles, ties broken by exchange order
+    if event_times:
+        event_times = np.concatenate(event_times)
+        event_ranks = np.concatenate(event_ranks)
+        event_rows = np.concatenate(event_rows)
+    order = np.lexsort((event_ranks, event_times))
+    event_times = np.asarray(event_times, dtype='int64')[order].tolist()
+    event_ranks = np.asarray(event_ranks, dtype='int64')[order].tolist()
+    event_rows = np.asarray(event_rows, dtype='int64')[order].tolist()
+    num_events = len(event_times)
+
+    # Rows carrying each signal, per symbol, for the opposite signal searches
+    signal_rows = {}
+
+    # Pending exits as (time, open sequence, slot, row, reason)
+    exits = []
+    sequence = 0
+
+    def schedule(slot: int, rank: int, start: int):
+        nonlocal sequence
+        side = int(positions.side[slot])
+        if rank not in signal_rows:
+            signal_rows[rank] = {BUY: np.flatnonzero(codes[rank] == BUY),
+                                 SELL: np.flatnonzero(codes[rank] == SELL)}
+        row, reason, extreme = solve_exit(
+            times[rank], closes[rank], codes[rank], start, side,
+            float(positions.entry_price[slot]), int(positions.entry_time[slot]),
+            float(positions.extreme[slot]), exit_rules,
+            signal_rows[rank][SELL if side == LONG else BUY],
+            atr=atrs[rank] if atrs is not None else None)
+        positions.extreme[slot] = extreme
+        if row >= 0:
+            heapq.heappush(exits, (int(times[rank][row]), sequence, slot, row, reason))
+        sequence += 1
+
+    # Positions already open are managed from the first candle on
+    for slot in positions.open_slots():
+        rank = rank_of_slot.get(slot)
+        if rank is not None and len(times[rank]):
+            schedule(slot, rank, 0)
+
+    logger.info("Starting portfolio backtest with %d symbols and %d signal candles",
+                len(symbols), num_events)
+
+    e = 0
+    while e < num_events or exits:
+        now = min(event_times[e] if e < num_events else math.inf,
+                  exits[0][0] if exits else math.inf)
+        timestamp = pd.Timestamp(now)
+
+        # Check for new signals in exchange order
+        while e < num_events and event_times[e] == now:
+            rank, row = event_ranks[e], event_rows[e]
+            symbol = symbols[rank]
+            if symbol not in positions:
+                balance, positions, trade_history = open_position_at(
+                    symbol, LABELS[int(codes[rank][row])], float(closes[rank][row]), timestamp,
+                    balance, positions, trade_history, risk_per_trade, logger)
+                if symbol in positions:
+                    schedule(positions.slot(symbol), rank, row)
+            e += 1
+            if e % 1000 == 0:
+                logger.info("Processed %d/%d signal candles", e, num_events)
+
+        # Close the positions exiting now, in the order they were opened
+        due = []
+        while exits and exits[0][0] == now:
+            due.append(heapq.heappop(exits))
+        if due:
+            balance, positions, trade_history = close_slots(
+                np.array([slot for _, _, slot, _, _ in due]),
+                np.array([reason for _, _, _, _, reason in due]),
+                np.array([closes[rank_of_slot[slot]][row] for _, _, slot, row, _ in due]),
+                timestamp, balance, positions, trade_history, logger)
+
+    return balance, positions, trade_history
@@ -0,0 +1,100 @@
+import numpy as np
+from settings.klines import interval_ms
+
+
+# Arrays returned by kline_arrays and kept by KlineBuffer
+KLINE_ARRAYS = ('timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time')
+TIME_ARRAYS = ('timestamp', 'close_time')
+
+
+def kline_arrays(klines) -> dict[str, np.ndarray]:
+    """Parse Binance klines straight into typed arrays (times as int64 ms, OHLCV as float64)"""
+    if len(klines) == 0:
+        return {name: np.empty(0, dtype=np.int64 if name in TIME_ARRAYS else np.float64)
+                for name in KLINE_ARRAYS}
+    ohlcv = np.array([k[1:6] for k in klines], dtype=np.float64)
+    times = np.array([(k[0], k[6]) for k in klines], dtype=np.int64)
+    return {
+        'timestamp': times[:, 0],
+        'open': ohlcv[:, 0],
+        'high': ohlcv[:, 1],
+        'low': ohlcv[:, 2],
+        'close': ohlcv[:, 3],
+        'volume': ohlcv[:, 4],
+        'close_time': times[:, 1]
+    }
+
+
+def concat_arrays(*parts: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    return {name: np.concatenate([part[name] for part in parts]) for name in KLINE_ARRAYS}
+
+
+def slice_arrays(candles: dict[str, np.ndarray], index) -> dict[str, np.ndarray]:
+    return {name: candles[name][index] for name in KLINE_ARRAYS}
+
+
+class KlineBuffer:
+    """Fixed-size ring buffer of the latest closed klines of one symbol, as typed arrays.
+
+    Every row is written twice, at its ring position and size rows further,
+    so the buffered candles are always one contiguous slice and arrays()
+    returns views instead of copies. The views are only valid until the
+    next append.
+    """
+
+    def __init__(self, interval: str = '5m', size: int = 500):
+        self.interval = interval
+        self.step = interval_ms(interval)
+        self.size = size
+        self._data = {name: np.zeros(2 * size, dtype=np.int64 if name in TIME_ARRAYS else np.float64)
+                      for name in KLINE_ARRAYS}
+        self.head = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    @property
+    def last_open_time(self) -> int:
+        """Open time of the newest buffered candle, None when empty"""
+        if not self.count:
+            return None
+        return int(self._data['timestamp'][self.head + self.count - 1])
+
+    @property
+    def next_open_time(self) -> int:
+        """Open time of the first candle not buffered yet, None when empty"""
+        last = self.last_open_time
+        return None if last is None else last + self.step
+
+    def append(self, candles: dict[str, np.ndarray]) -> int:
+        """Append candles newer than the buffered ones, dropping the oldest; returns the rows added"""
+        timestamp = candles['timestamp']
+        if self.count:
+            candles = slice_arrays(candles, timestamp > self.last_open_time)
+        n = len(candles['timestamp'])
+        if n == 0:
+            return 0
+
+        if n >= self.size:
+            self.head, self.count = 0, self.size
+            for name, data in self._data.items():
+                data[:self.size] = data[self.size:] = candles[name][-self.size:]
+            return n
+
+        positions = (self.head + self.count + np.arange(n)) % self.size
+        for name, data in self._data.items():
+            data[positions] = data[positions + self.size] = candles[name]
+        self.count += n
+        if self.count > self.size:
+            self.head = (self.head + self.count - self.size) % self.size
+            self.count = self.size
+        return n
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """Buffered candles, oldest first"""
+        return {name: data[self.head:self.head + self.count] for name, data in self._data.items()}
@@ -1,10 +1,15 @@
 import os
 from dotenv import load_dotenv
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from binance.spot import Spot
 
 import mysql.connector
 
+from settings.metrics import LatencyTracker, api_latency, latency_hook
+
 from sqlalchemy import create_engine
 from urllib.parse import quote_plus
 
@@ -12,18 +17,54 @@ from urllib.parse import quote_plus
 load_dotenv()
 
 
+# HTTP settings for the Binance REST client
+BINANCE_TIMEOUT = 10
+BINANCE_POOL_SIZE = 20
+BINANCE_RETRIES = 3
+
+
+def tune_session(session: requests.Session, pool_size: int = BINANCE_POOL_SIZE, retries: int = BINANCE_RETRIES,
+                 tracker: LatencyTracker = api_latency):
+    """Keep-alive connection pool with retries and latency tracking.
+
+    Only idempotent GET requests are retried, on connection errors and 5xx
+    responses, so orders are never sent twice.
+    """
+    retry = Retry(total=retries, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET']), respect_retry_after_header=True,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Connection': 'keep-alive'})
+    if tracker is not None:
+        session.hooks['response'].append(latency_hook(tracker))
+    return session
+
+
 # Connect to Binance API
-def binance_client(testnet: bool = False):
+def binance_client(testnet: bool = False, timeout: float = BINANCE_TIMEOUT, pool_size: int = BINANCE_POOL_SIZE):
     if not testnet:
-        return Spot(api_key=os.getenv('BINANCE_API_KEY'),
-                    api_secret=os.getenv('BINANCE_API_SECRET'),
-                    base_url='https://api.binance.com')
+        client = Spot(api_key=os.getenv('BINANCE_API_KEY'),
+                      api_secret=os.getenv('BINANCE_API_SECRET'),
+                      base_url='https://api.binance.com',
+                      timeout=timeout)
     elif testnet:
-        return Spot(api_key=os.getenv('BINANCE_API_KEY_TEST'),
-                    api_secret=os.getenv('BINANCE_API_SECRET_TEST'),
-                    base_url='https://testnet.binance.vision')
+        client = Spot(api_key=os.getenv('BINANCE_API_KEY_TEST'),
+                      api_secret=os.getenv('BINANCE_API_SECRET_TEST'),
+                      base_url='https://testnet.binance.vision',
+                      timeout=timeout)
     else:
         ValueError('Invalid testnet value. Must be True or False.')
+    tune_session(client.session, pool_size)
+    return client
+
+
+# WebSocket market stream base URL
+def binance_stream_url(testnet: bool = False) -> str:
+    if testnet:
+        return 'wss://stream.testnet.binance.vision'
+    return 'wss://stream.binance.com:9443'
 
 
 # Connect to MySQL database
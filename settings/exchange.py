@@ -0,0 +1,155 @@
+import time
+import logging
+import threading
+from binance.spot import Spot
+
+
+# Seconds before the exchange metadata is downloaded again
+EXCHANGE_INFO_TTL = 3600
+
+# Seconds in each rate limit interval unit
+INTERVAL_SECONDS = {'SECOND': 1, 'MINUTE': 60, 'HOUR': 3600, 'DAY': 86400}
+
+# Shared caches per API base URL
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class ExchangeInfo:
+    """exchange_info with a TTL and prebuilt indexes.
+
+    The payload is downloaded at most once per ttl seconds. If a refresh
+    fails, the previous data is kept and the next call tries again.
+    invalidate() forces a refresh, e.g. after an order was rejected for its
+    filters. Symbol lists keep the exchange order.
+    """
+
+    def __init__(self, client: Spot, ttl: float = EXCHANGE_INFO_TTL, permissions: tuple = ('SPOT',),
+                 logger: logging.Logger = None):
+        self.client = client
+        self.ttl = ttl
+        self.permissions = list(permissions)
+        self.logger = logger or logging.getLogger(__name__)
+        self.fetched_at = None
+        self._lock = threading.Lock()
+        self._symbols = {}
+        self._by_quote = {}
+        self._by_base = {}
+        self._filters = {}
+        self._rate_limits = []
+
+    def refresh(self):
+        """Download exchange_info and rebuild the indexes"""
+        payload = self.client.exchange_info(permissions=self.permissions)
+        symbols, by_quote, by_base, filters = {}, {}, {}, {}
+        for info in payload['symbols']:
+            name = info['symbol']
+            symbols[name] = info
+            by_quote.setdefault(info['quoteAsset'], []).append(name)
+            by_base.setdefault(info['baseAsset'], []).append(name)
+            filters[name] = {f['filterType']: f for f in info.get('filters', [])}
+        self._symbols, self._by_quote, self._by_base, self._filters = symbols, by_quote, by_base, filters
+        self._rate_limits = payload.get('rateLimits', [])
+        self.fetched_at = time.time()
+
+    def invalidate(self):
+        self.fetched_at = None
+
+    def _current(self):
+        if self.fetched_at is not None and time.time() - self.fetched_at < self.ttl:
+            return
+        with self._lock:
+            if self.fetched_at is not None and time.time() - self.fetched_at < self.ttl:
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                if not self._symbols:
+                    raise
+                self.logger.warning('Keeping stale exchange info, refresh failed: %s', e)
+
+    @property
+    def symbols(self) -> list:
+        """Every symbol name, in exchange order"""
+        self._current()
+        return list(self._symbols)
+
+    def symbol(self, name: str) -> dict:
+        """Raw symbol entry, None for unknown symbols"""
+        self._current()
+        return self._symbols.get(name)
+
+    def status(self, name: str) -> str:
+        info = self.symbol(name)
+        return info['status'] if info else None
+
+    def is_trading(self, name: str) -> bool:
+        return self.status(name) == 'TRADING'
+
+    def by_quote(self, asset: str, status: str = None) -> list:
+        """Symbols quoted in asset, optionally only those with the given status"""
+        self._current()
+        return [name for name in self._by_quote.get(asset, [])
+                if status is None or self._symbols[name]['status'] == status]
+
+    def by_base(self, asset: str, status: str = None) -> list:
+        """Symbols whose base asset is asset, optionally only those with the given status"""
+        self._current()
+        return [name for name in self._by_base.get(asset, [])
+                if status is None or self._symbols[name]['status'] == status]
+
+    def universe(self, asset: str, status: str = 'TRADING') -> list:
+        """Symbols with asset on either side: those quoted in it first, then those based on it"""
+        return self.by_quote(asset, status) + self.by_base(asset, status)
+
+    def filters(self, name: str) -> dict:
+        """Raw filters of a symbol by filterType"""
+        self._current()
+        return self._filters.get(name, {})
+
+    def lot_size(self, name: str, market: bool = False) -> dict:
+        """LOT_SIZE as floats: minQty, maxQty, stepSize.
+
+        With market, the MARKET_LOT_SIZE limits replace them where the
+        symbol has that filter; the exchange leaves unused ones at zero,
+        those keep the LOT_SIZE value.
+        """
+        filters = self.filters(name)
+        f = filters.get('LOT_SIZE')
+        if f is None:
+            return None
+        lot = {key: float(f[key]) for key in ('minQty', 'maxQty', 'stepSize')}
+        if market and 'MARKET_LOT_SIZE' in filters:
+            lot.update({key: float(value) for key, value in filters['MARKET_LOT_SIZE'].items()
+                        if key in lot and float(value) > 0})
+        return lot
+
+    def min_notional(self, name: str) -> float:
+        """Minimum order value in the quote asset (MIN_NOTIONAL, or the newer NOTIONAL filter)"""
+        filters = self.filters(name)
+        f = filters.get('MIN_NOTIONAL') or filters.get('NOTIONAL')
+        return float(f['minNotional']) if f else 0.0
+
+    def order_rate(self, default: float = 10.0) -> tuple:
+        """Orders per second and burst size allowed by the short-term ORDERS limits.
+
+        Windows longer than a minute (the daily order count) are left out, they
+        only matter to something placing orders all day long.
+        """
+        self._current()
+        windows = [(limit['intervalNum'] * INTERVAL_SECONDS[limit['interval']], limit['limit'])
+                   for limit in self._rate_limits
+                   if limit['rateLimitType'] == 'ORDERS' and limit['interval'] in INTERVAL_SECONDS]
+        windows = [(seconds, limit) for seconds, limit in windows if seconds <= 60]
+        if not windows:
+            return default, default
+        return min(limit / seconds for seconds, limit in windows), min(limit for _, limit in windows)
+
+
+def exchange_info(client: Spot, ttl: float = EXCHANGE_INFO_TTL) -> ExchangeInfo:
+    """Shared ExchangeInfo for the API the client points at"""
+    with _caches_lock:
+        cache = _caches.get(client.base_url)
+        if cache is None:
+            cache = _caches[client.base_url] = ExchangeInfo(client, ttl)
+        return cache
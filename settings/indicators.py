@@ -1,21 +1,128 @@
 import numpy as np
-from typing import Dict
+from collections import deque
+from typing import Dict, Tuple
 
 
-def rsi(prices: np.ndarray, window: int = 14) -> np.ndarray:
-    """Vectorized RSI calculation"""
-    deltas = np.diff(prices)
+def _linear_recurrence(x: np.ndarray, decay: float, block: int = 64) -> np.ndarray:
+    """Solve y[i] = decay * y[i-1] + x[i] along the last axis without a Python loop.
+
+    The series is cut into blocks solved with one matrix product each; the
+    values carried from block to block obey the same recurrence with
+    decay**block, so they are solved recursively on a series block times shorter.
+    """
+    n = x.shape[-1]
+    k = np.arange(min(n, block))
+    lags = k[:, None] - k[None, :]
+    kernel = np.where(lags >= 0, decay ** np.maximum(lags, 0), 0.0)
+    if n <= block:
+        return x @ kernel.T
+
+    num_blocks = -(-n // block)
+    padded = np.zeros(x.shape[:-1] + (num_blocks * block,))
+    padded[..., :n] = x
+    blocks = padded.reshape(x.shape[:-1] + (num_blocks, block)) @ kernel.T
+
+    carry = _linear_recurrence(blocks[..., -1], decay ** block, block)
+    carry_in = np.zeros_like(carry)
+    carry_in[..., 1:] = carry[..., :-1]
+    blocks += carry_in[..., None] * decay ** (k + 1)
+    return blocks.reshape(padded.shape)[..., :n]
+
+
+def _first_valid(prices: np.ndarray) -> np.ndarray:
+    """Index of the first non-NaN value of every row (row length if none)"""
+    valid = ~np.isnan(prices)
+    return np.where(valid.any(axis=1), valid.argmax(axis=1), prices.shape[1])
+
+
+def _seeded_recurrence(values: np.ndarray, seed_idx: np.ndarray, seed: np.ndarray, weight: float, decay: float) -> np.ndarray:
+    """Run y[i] = decay * y[i-1] + weight * values[i] from a per-row seed, NaN before it.
+
+    A NaN seed or value after the seed makes every later output NaN, like a
+    plain loop would; NaNs are zeroed for the matrix products, which would
+    otherwise spread them to whole blocks.
+    """
+    rows, n = values.shape
+    cols = np.arange(n)
+    after_seed = cols[None, :] > seed_idx[:, None]
+    x = np.where(after_seed, weight * np.nan_to_num(values), 0.0)
+    poisoned = after_seed & np.isnan(values)
+    has_seed = seed_idx < n
+    x[has_seed, seed_idx[has_seed]] = np.nan_to_num(seed[has_seed])
+    poisoned[has_seed, seed_idx[has_seed]] = np.isnan(seed[has_seed])
+    out = _linear_recurrence(x, decay)
+    out[np.logical_or.accumulate(poisoned, axis=1)] = np.nan
+    out[cols[None, :] < seed_idx[:, None]] = np.nan
+    out[~has_seed] = np.nan
+    return out
+
+
+def _window_mean(values: np.ndarray, start: np.ndarray, window: int) -> np.ndarray:
+    """Mean of values[row, start:start + window] for every row"""
+    idx = np.minimum(start[:, None] + np.arange(window), values.shape[1] - 1)
+    return np.take_along_axis(values, idx, axis=1).mean(axis=1)
+
+
+def pad_series(series: list) -> np.ndarray:
+    """Stack 1-D price series of any length into a (symbols x candles) array, NaN-padded on the left"""
+    length = max((len(s) for s in series), default=0)
+    out = np.full((len(series), length), np.nan)
+    for row, values in enumerate(series):
+        if len(values):
+            out[row, length - len(values):] = values
+    return out
+
+
+def batch_apply(series: list, func, chunk_size: int = 32) -> list:
+    """Run a 2-D batch indicator over many 1-D series, chunked by length to limit padding.
+
+    func maps a padded (symbols x candles) array to an array or a dict of
+    arrays of the same shape; the result for every series is trimmed back to
+    its own length and returned in the original order.
+    """
+    results = [None] * len(series)
+    order = sorted(range(len(series)), key=lambda i: len(series[i]))
+    for start in range(0, len(order), chunk_size):
+        chunk = order[start:start + chunk_size]
+        prices = pad_series([series[i] for i in chunk])
+        values = func(prices)
+        for row, i in enumerate(chunk):
+            offset = prices.shape[1] - len(series[i])
+            if isinstance(values, dict):
+                results[i] = {name: v[row, offset:]
+                              for name, v in values.items()}
+            else:
+                results[i] = values[row, offset:]
+    return results
+
+
+def _rsi_averages(prices: np.ndarray, window: int = 14):
+    """Wilder-smoothed average gains and losses behind the RSI, one row per symbol"""
+    deltas = np.diff(prices, axis=1)
     gains = np.where(deltas > 0, deltas, 0)
     losses = np.where(deltas < 0, -deltas, 0)
 
-    avg_gain = np.zeros_like(prices)
-    avg_loss = np.zeros_like(prices)
-    avg_gain[window] = gains[:window].mean()
-    avg_loss[window] = losses[:window].mean()
+    if deltas.shape[1] == 0:
+        empty = np.full(prices.shape, np.nan)
+        return empty, empty.copy()
 
-    for i in range(window + 1, len(prices)):
-        avg_gain[i] = (avg_gain[i-1] * (window - 1) + gains[i-1]) / window
-        avg_loss[i] = (avg_loss[i-1] * (window - 1) + losses[i-1]) / window
+    # avg[i] averages the deltas ending at price i, so gains[i-1] feeds it
+    seed_idx = _first_valid(prices) + window
+    shifted_gains = np.pad(gains, ((0, 0), (1, 0)))
+    shifted_losses = np.pad(losses, ((0, 0), (1, 0)))
+    start = np.minimum(seed_idx - window, deltas.shape[1] - 1)
+
+    avg_gain = _seeded_recurrence(shifted_gains, seed_idx, _window_mean(
+        gains, start, window), 1 / window, (window - 1) / window)
+    avg_loss = _seeded_recurrence(shifted_losses, seed_idx, _window_mean(
+        losses, start, window), 1 / window, (window - 1) / window)
+    return avg_gain, avg_loss
+
+
+def rsi_batch(prices: np.ndarray, window: int = 14) -> np.ndarray:
+    """Loop-free RSI for a (symbols x candles) array of prices"""
+    prices = np.atleast_2d(np.asarray(prices, dtype=float))
+    avg_gain, avg_loss = _rsi_averages(prices, window)
 
     with np.errstate(divide='ignore', invalid='ignore'):
         rs = np.divide(avg_gain,
@@ -24,48 +131,284 @@ def rsi(prices: np.ndarray, window: int = 14) -> np.ndarray:
                        where=avg_loss != 0)
         rsi = 100 - (100 / (1 + rs))
 
-    rsi[:window] = np.nan
+    rsi[np.isnan(avg_gain)] = np.nan
     return rsi
 
 
-def ema(prices: np.ndarray, period: int) -> np.ndarray:
-    """Vectorized EMA calculation"""
-    if len(prices) < period:
-        return np.full_like(prices, np.nan)
+def ema_batch(prices: np.ndarray, period: int) -> np.ndarray:
+    """Loop-free EMA for a (symbols x candles) array, seeded after each row's leading NaNs"""
+    prices = np.atleast_2d(np.asarray(prices, dtype=float))
+    if prices.shape[1] == 0:
+        return prices.copy()
 
-    ema = np.full_like(prices, np.nan)
     multiplier = 2 / (period + 1)
-    ema[period-1] = prices[:period].mean()
+    first = _first_valid(prices)
+    seed = _window_mean(prices, np.minimum(
+        first, prices.shape[1] - 1), period)
+    return _seeded_recurrence(prices, first + period - 1, seed, multiplier, 1 - multiplier)
 
-    for i in range(period, len(prices)):
-        ema[i] = (prices[i] - ema[i-1]) * multiplier + ema[i-1]
 
-    return ema
+def macd_batch(prices: np.ndarray, fast_period: int = 12, slow_period: int = 26, signal_period: int = 9) -> Dict[str, np.ndarray]:
+    """Loop-free MACD for a (symbols x candles) array of prices"""
+    macd_line = ema_batch(prices, fast_period) - \
+        ema_batch(prices, slow_period)
+    signal_line = ema_batch(macd_line, signal_period)
+
+    return {
+        'macd_line': macd_line,
+        'signal_line': signal_line,
+        'histogram': macd_line - signal_line
+    }
+
+
+def true_range_batch(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    """True range for (symbols x candles) arrays; the first candle only has high - low"""
+    high, low, close = (np.atleast_2d(np.asarray(a, dtype=float)) for a in (high, low, close))
+    prev_close = np.full(close.shape, np.nan)
+    prev_close[:, 1:] = close[:, :-1]
+    return np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+
+def atr_batch(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> np.ndarray:
+    """Loop-free ATR (simple mean of the last period true ranges), NaN until a full window"""
+    true_range = true_range_batch(high, low, close)
+    out = np.full(true_range.shape, np.nan)
+    if true_range.shape[1] >= period:
+        windows = np.lib.stride_tricks.sliding_window_view(true_range, period, axis=1)
+        out[:, period - 1:] = windows.sum(axis=-1) / period
+    return out
+
+
+def rsi(prices: np.ndarray, window: int = 14) -> np.ndarray:
+    """Vectorized RSI calculation"""
+    return rsi_batch(prices, window)[0]
+
+
+def ema(prices: np.ndarray, period: int) -> np.ndarray:
+    """Vectorized EMA calculation"""
+    return ema_batch(prices, period)[0]
 
 
 def macd(prices: np.ndarray, fast_period: int = 12, slow_period: int = 26, signal_period: int = 9) -> Dict[str, np.ndarray]:
-    fast_ema = ema(prices, fast_period)
-    slow_ema = ema(prices, slow_period)
-    macd_line = fast_ema - slow_ema
+    return {name: values[0] for name, values in macd_batch(
+        prices, fast_period, slow_period, signal_period).items()}
 
-    # Find the first non-NaN index in macd_line
-    first_valid_idx = np.where(~np.isnan(macd_line))[0]
-    if len(first_valid_idx) == 0:
-        return {'macd_line': macd_line, 'signal_line': macd_line, 'histogram': macd_line}
 
-    first_valid_idx = first_valid_idx[0]
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> np.ndarray:
+    """Vectorized ATR calculation"""
+    return atr_batch(high, low, close, period)[0]
 
-    # Calculate signal line only on valid macd values
-    valid_macd = macd_line[first_valid_idx:]
-    signal_line_full = np.full_like(macd_line, np.nan)
 
-    if len(valid_macd) >= signal_period:
-        signal_line_valid = ema(valid_macd, signal_period)
-        signal_line_full[first_valid_idx + signal_period -
-                         1:] = signal_line_valid[signal_period - 1:]
+class EMA:
+    """Streaming EMA that matches ema() to rounding, updated in O(1) per candle"""
 
-    return {
-        'macd_line': macd_line,
-        'signal_line': signal_line_full,
-        'histogram': macd_line - signal_line_full
-    }
+    def __init__(self, period: int):
+        self.period = period
+        self.multiplier = 2 / (period + 1)
+        self.value = np.nan
+        self._warmup = []
+
+    @classmethod
+    def seed(cls, prices: np.ndarray, period: int) -> 'EMA':
+        state = cls(period)
+        if len(prices) < period:
+            state._warmup = [float(p) for p in prices]
+        else:
+            state.value = float(ema(prices, period)[-1])
+        return state
+
+    def peek(self, price: float) -> float:
+        """EMA value if price closed the next candle, without committing it"""
+        if not np.isnan(self.value):
+            return (price - self.value) * self.multiplier + self.value
+        if len(self._warmup) + 1 == self.period:
+            return float(np.mean(self._warmup + [price]))
+        return np.nan
+
+    def update(self, price: float) -> float:
+        value = self.peek(price)
+        if np.isnan(value):
+            self._warmup.append(price)
+        else:
+            self._warmup = []
+        self.value = value
+        return value
+
+
+class RSI:
+    """Streaming RSI that matches rsi() to rounding, updated in O(1) per candle"""
+
+    def __init__(self, window: int = 14):
+        self.window = window
+        self.prev_price = np.nan
+        self.avg_gain = np.nan
+        self.avg_loss = np.nan
+        self._gains = []
+        self._losses = []
+
+    @classmethod
+    def seed(cls, prices: np.ndarray, window: int = 14) -> 'RSI':
+        state = cls(window)
+        if len(prices) <= window:
+            for price in prices:
+                state.update(float(price))
+            return state
+        avg_gain, avg_loss = _rsi_averages(np.atleast_2d(prices), window)
+        state.avg_gain = float(avg_gain[0, -1])
+        state.avg_loss = float(avg_loss[0, -1])
+        state.prev_price = float(prices[-1])
+        return state
+
+    @property
+    def value(self) -> float:
+        return self._value(self.avg_gain, self.avg_loss)
+
+    @staticmethod
+    def _value(avg_gain: float, avg_loss: float) -> float:
+        if np.isnan(avg_gain):
+            return np.nan
+        rs = avg_gain / avg_loss if avg_loss != 0 else 1.0
+        return 100 - (100 / (1 + rs))
+
+    def _step(self, price: float) -> Tuple[float, float]:
+        if np.isnan(self.prev_price):
+            return np.nan, np.nan
+        delta = price - self.prev_price
+        gain = delta if delta > 0 else 0
+        loss = -delta if delta < 0 else 0
+        if not np.isnan(self.avg_gain):
+            return ((self.avg_gain * (self.window - 1) + gain) / self.window,
+                    (self.avg_loss * (self.window - 1) + loss) / self.window)
+        if len(self._gains) + 1 == self.window:
+            return (float(np.mean(self._gains + [gain])),
+                    float(np.mean(self._losses + [loss])))
+        return np.nan, np.nan
+
+    def peek(self, price: float) -> float:
+        """RSI value if price closed the next candle, without committing it"""
+        return self._value(*self._step(price))
+
+    def update(self, price: float) -> float:
+        avg_gain, avg_loss = self._step(price)
+        if np.isnan(avg_gain) and not np.isnan(self.prev_price):
+            delta = price - self.prev_price
+            self._gains.append(delta if delta > 0 else 0)
+            self._losses.append(-delta if delta < 0 else 0)
+        elif not np.isnan(avg_gain):
+            self._gains, self._losses = [], []
+        self.avg_gain, self.avg_loss = avg_gain, avg_loss
+        self.prev_price = price
+        return self.value
+
+
+class MACD:
+    """Streaming MACD that matches macd() to rounding, updated in O(1) per candle"""
+
+    def __init__(self, fast_period: int = 12, slow_period: int = 26, signal_period: int = 9):
+        self.fast = EMA(fast_period)
+        self.slow = EMA(slow_period)
+        self.signal = EMA(signal_period)
+
+    @classmethod
+    def seed(cls, prices: np.ndarray, fast_period: int = 12, slow_period: int = 26, signal_period: int = 9) -> 'MACD':
+        state = cls(fast_period, slow_period, signal_period)
+        state.fast = EMA.seed(prices, fast_period)
+        state.slow = EMA.seed(prices, slow_period)
+        macd_line = ema(prices, fast_period) - ema(prices, slow_period)
+        state.signal = EMA.seed(macd_line[~np.isnan(macd_line)], signal_period)
+        return state
+
+    @property
+    def macd_line(self) -> float:
+        return self.fast.value - self.slow.value
+
+    @property
+    def signal_line(self) -> float:
+        return self.signal.value
+
+    def peek(self, price: float) -> Tuple[float, float, float]:
+        """MACD line, signal line and histogram if price closed the next candle"""
+        macd_line = self.fast.peek(price) - self.slow.peek(price)
+        signal_line = self.signal.peek(macd_line) if not np.isnan(
+            macd_line) else np.nan
+        return macd_line, signal_line, macd_line - signal_line
+
+    def update(self, price: float) -> Tuple[float, float, float]:
+        macd_line = self.fast.update(price) - self.slow.update(price)
+        signal_line = self.signal.update(macd_line) if not np.isnan(
+            macd_line) else np.nan
+        return macd_line, signal_line, macd_line - signal_line
+
+
+class ATR:
+    """Streaming ATR that matches atr() to rounding, updated in O(1) per candle.
+
+    The last period true ranges are kept with their running sum; NaN ranges
+    are counted apart so the value is NaN while one is in the window, like
+    atr() gives.
+    """
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.prev_close = np.nan
+        self._ranges = deque(maxlen=period)
+        self._sum = 0.0
+        self._nans = 0
+
+    @classmethod
+    def seed(cls, high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> 'ATR':
+        state = cls(period)
+        if len(close):
+            for true_range in true_range_batch(high, low, close)[0, -period:]:
+                state._push(float(true_range))
+            state.prev_close = float(close[-1])
+        return state
+
+    @property
+    def value(self) -> float:
+        return self._mean(len(self._ranges), self._sum, self._nans)
+
+    def _mean(self, count: int, total: float, nans: int) -> float:
+        if count < self.period or nans:
+            return np.nan
+        return total / self.period
+
+    def _evicted(self) -> float:
+        # True range leaving the window when the next one comes in, None while it fills
+        return self._ranges[0] if len(self._ranges) == self.period else None
+
+    def _push(self, true_range: float):
+        evicted = self._evicted()
+        if evicted is not None:
+            if np.isnan(evicted):
+                self._nans -= 1
+            else:
+                self._sum -= evicted
+        self._ranges.append(true_range)
+        if np.isnan(true_range):
+            self._nans += 1
+        else:
+            self._sum += true_range
+
+    def _true_range(self, high: float, low: float) -> float:
+        return float(np.fmax(high - low, np.fmax(abs(high - self.prev_close), abs(low - self.prev_close))))
+
+    def peek(self, high: float, low: float, close: float) -> float:
+        """ATR value if this candle closed next, without committing it"""
+        true_range, evicted = self._true_range(high, low), self._evicted()
+        count, total, nans = min(len(self._ranges) + 1, self.period), self._sum, self._nans
+        if evicted is not None:
+            if np.isnan(evicted):
+                nans -= 1
+            else:
+                total -= evicted
+        if np.isnan(true_range):
+            nans += 1
+        else:
+            total += true_range
+        return self._mean(count, total, nans)
+
+    def update(self, high: float, low: float, close: float) -> float:
+        self._push(self._true_range(high, low))
+        self.prev_close = close
+        return self.value
@@ -0,0 +1,235 @@
+import os
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
+
+
+# Local kline cache location and the interval stored in the klines table
+CACHE_DIR = os.getenv('KLINE_CACHE_DIR', 'settings/cache')
+BASE_INTERVAL = '5m'
+
+# Cached columns and their on-disk types
+COLUMNS = {
+    'open_time': np.int64,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.float64
+}
+
+
+# Length of each kline interval unit in milliseconds
+INTERVAL_UNITS_MS = {'s': 1000, 'm': 60000, 'h': 3600000,
+                     'd': 86400000, 'w': 604800000}
+
+
+def interval_ms(interval: str) -> int:
+    """Length of a Binance kline interval such as '5m' or '1h' in milliseconds"""
+    if interval[-1] not in INTERVAL_UNITS_MS or not interval[:-1].isdigit():
+        raise ValueError(f'Unsupported kline interval: {interval}')
+    return int(interval[:-1]) * INTERVAL_UNITS_MS[interval[-1]]
+
+
+def to_ms(moment) -> int:
+    """Milliseconds since epoch of anything pandas understands as a timestamp"""
+    if moment is None or isinstance(moment, (int, np.integer)):
+        return moment
+    return pd.Timestamp(moment).value // 10**6
+
+
+def stream_klines(engine, symbols: list = None, start=None, end=None, chunk_size: int = 50000):
+    """Stream klines for many symbols out of one ordered query.
+
+    Rows come through a server-side (unbuffered) cursor and are turned into
+    typed arrays chunk by chunk; a (symbol, arrays) pair is yielded as soon as
+    all rows of that symbol have arrived. symbols, start and end (inclusive
+    open_time bounds) restrict what is read.
+    """
+    conditions, params = [], {}
+    if symbols is not None:
+        conditions.append('symbol IN :symbols')
+        params['symbols'] = list(symbols)
+    if start is not None:
+        conditions.append('open_time >= :start')
+        params['start'] = to_ms(start)
+    if end is not None:
+        conditions.append('open_time <= :end')
+        params['end'] = to_ms(end)
+
+    query = text(f"""
+    SELECT symbol, {', '.join(COLUMNS)}
+    FROM klines
+    {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+    ORDER BY symbol, open_time ASC
+    """)
+    if symbols is not None:
+        if not params['symbols']:
+            return
+        query = query.bindparams(bindparam('symbols', expanding=True))
+
+    current, parts = None, []
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True).execute(query, params)
+        for rows in result.partitions(chunk_size):
+            names = [row[0] for row in rows]
+            # Rows are ordered by symbol, so every chunk splits into runs
+            bounds = [0] + [i for i in range(1, len(names))
+                            if names[i] != names[i - 1]] + [len(names)]
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                run = rows[lo:hi]
+                arrays = {
+                    column: pd.to_numeric(np.array([row[k + 1] for row in run], dtype=object),
+                                          errors='coerce').astype(dtype)
+                    for k, (column, dtype) in enumerate(COLUMNS.items())
+                }
+                if names[lo] != current:
+                    if current is not None:
+                        yield current, _concat(parts)
+                    current, parts = names[lo], []
+                parts.append(arrays)
+    if current is not None:
+        yield current, _concat(parts)
+
+
+def _concat(parts: list) -> dict[str, np.ndarray]:
+    return {column: np.concatenate([part[column] for part in parts]) for column in COLUMNS}
+
+
+class KlineCache:
+    """Columnar kline files per symbol and interval, memory-mapped on read.
+
+    Every column is a flat binary file that only ever grows, so syncing
+    appends the new rows instead of rewriting the history. open_time is
+    written last and defines how many rows are valid, which keeps the cache
+    consistent if a sync is interrupted halfway.
+    """
+
+    def __init__(self, root: str = CACHE_DIR):
+        self.root = root
+
+    def _path(self, symbol: str, interval: str, column: str) -> str:
+        return os.path.join(self.root, interval, symbol, f'{column}.bin')
+
+    def size(self, symbol: str, interval: str = BASE_INTERVAL) -> int:
+        """Number of cached rows"""
+        path = self._path(symbol, interval, 'open_time')
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // np.dtype(COLUMNS['open_time']).itemsize
+
+    def last_open_time(self, symbol: str, interval: str = BASE_INTERVAL):
+        """open_time of the newest cached row, None when nothing is cached"""
+        n = self.size(symbol, interval)
+        if n == 0:
+            return None
+        return int(self.read(symbol, interval, ('open_time',))['open_time'][-1])
+
+    def read(self, symbol: str, interval: str = BASE_INTERVAL, columns: tuple = ('open_time', 'close')) -> dict[str, np.ndarray]:
+        """Read-only memory maps of the requested columns"""
+        n = self.size(symbol, interval)
+        data = {}
+        for column in columns:
+            if n == 0:
+                data[column] = np.empty(0, dtype=COLUMNS[column])
+            else:
+                data[column] = np.memmap(self._path(symbol, interval, column),
+                                         dtype=COLUMNS[column], mode='r', shape=(n,))
+        return data
+
+    def append(self, symbol: str, interval: str, data: dict[str, np.ndarray]):
+        """Append rows holding every column in COLUMNS"""
+        if len(data['open_time']) == 0:
+            return
+        n = self.size(symbol, interval)
+        os.makedirs(os.path.dirname(
+            self._path(symbol, interval, 'open_time')), exist_ok=True)
+
+        # open_time goes last, it marks the rows as valid
+        for column in [c for c in COLUMNS if c != 'open_time'] + ['open_time']:
+            dtype = np.dtype(COLUMNS[column])
+            path = self._path(symbol, interval, column)
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                # Drop rows left over by an interrupted sync
+                f.truncate(n * dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(
+                    data[column], dtype=dtype).tobytes())
+
+    def sync(self, engine, symbol: str, interval: str = BASE_INTERVAL) -> int:
+        """Fetch the rows newer than the cached ones from the klines table"""
+        if interval != BASE_INTERVAL:
+            raise ValueError(
+                f'The klines table only stores {BASE_INTERVAL} candles, not {interval}')
+
+        last = self.last_open_time(symbol, interval)
+        query = text("""
+        SELECT open_time, open, high, low, close, volume
+        FROM klines
+        WHERE symbol = :symbol AND open_time > :last
+        ORDER BY open_time ASC
+        """)
+        df = pd.read_sql(query, engine, params={
+                         'symbol': symbol, 'last': -1 if last is None else last})
+        self.append(symbol, interval, {
+            column: pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=dtype)
+            for column, dtype in COLUMNS.items()
+        })
+        return len(df)
+
+    def sync_all(self, engine, symbols: list = None, end=None) -> dict[str, int]:
+        """Bring many symbols up to date with one streamed query per group.
+
+        Symbols are grouped by the last cached open_time and each group is
+        read from there on, new symbols from the beginning, so one stale
+        symbol does not make the others read its history again. end
+        (inclusive open_time) stops every query there; the cache only grows
+        forward without gaps, so there is no lower bound besides it.
+        """
+        if symbols is None:
+            symbols = pd.read_sql(text("""
+            SELECT DISTINCT symbol
+            FROM klines
+            ORDER BY symbol
+            """), engine)['symbol'].tolist()
+
+        groups = {}
+        for symbol in symbols:
+            groups.setdefault(self.last_open_time(symbol), []).append(symbol)
+
+        added = dict.fromkeys(symbols, 0)
+        for last, group in groups.items():
+            if end is not None and last is not None and last >= to_ms(end):
+                continue
+            for symbol, arrays in stream_klines(engine, group, None if last is None else last + 1, end):
+                self.append(symbol, BASE_INTERVAL, arrays)
+                added[symbol] = len(arrays['open_time'])
+        return added
+
+
+def load_klines(engine, symbol: str, cache: KlineCache = None, refresh: bool = True, start=None, end=None,
+                columns: tuple = ('close',)) -> pd.DataFrame:
+    """Prices of a symbol (close only by default) as a timestamp-indexed DataFrame, served from the local cache.
+
+    The cache is topped up from the database first unless refresh is False,
+    in which case the database is not touched at all. start and end limit
+    the rows loaded to an inclusive open_time range.
+    """
+    cache = cache or KlineCache()
+    if refresh:
+        cache.sync(engine, symbol)
+    data = cache.read(symbol, BASE_INTERVAL, ('open_time',) + tuple(columns))
+
+    if start is not None or end is not None:
+        open_time = data['open_time']
+        lo = 0 if start is None else np.searchsorted(
+            open_time, to_ms(start), 'left')
+        hi = len(open_time) if end is None else np.searchsorted(
+            open_time, to_ms(end), 'right')
+        data = {column: values[lo:hi] for column, values in data.items()}
+
+    df = pd.DataFrame({column: np.asarray(data[column]) for column in columns},
+                      index=pd.to_datetime(np.asarray(data['open_time']), unit='ms'))
+    df.index.name = 'timestamp'
+    return df
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import numpy as np
+
+
+# Friendly names of the Binance endpoints the bot calls
+ENDPOINT_NAMES = {
+    ('GET', '/api/v3/klines'): 'klines',
+    ('GET', '/api/v3/account'): 'account',
+    ('POST', '/api/v3/order'): 'new_order',
+    ('GET', '/api/v3/exchangeInfo'): 'exchange_info',
+    ('GET', '/api/v3/ticker/price'): 'ticker_price',
+    ('GET', '/api/v3/ping'): 'ping',
+    ('GET', '/api/v3/time'): 'time'
+}
+
+# Percentiles reported for every histogram
+PERCENTILES = (50, 90, 99)
+
+
+class RollingHistogram:
+    """Percentiles over the last window observations, plus lifetime count and sum"""
+
+    def __init__(self, window: int = 1024):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.values.append(value)
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> dict:
+        values = np.fromiter(self.values, dtype=float, count=len(self.values))
+        summary = {'count': self.count, 'sum': self.total}
+        for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES) if len(values) else [np.nan] * len(PERCENTILES)):
+            summary[f'p{q}'] = float(value)
+        summary['max'] = float(values.max()) if len(values) else np.nan
+        return summary
+
+
+class LatencyTracker:
+    """Thread-safe rolling histograms keyed by name, e.g. one per endpoint"""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = RollingHistogram(self.window)
+            histogram.observe(value)
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())}
+
+    def summary(self) -> str:
+        """One line per histogram with its count, p50 and p99 in milliseconds"""
+        return '\n'.join(f'{name}: n={values["count"]} p50={values["p50"]:.1f} ms p99={values["p99"]:.1f} ms'
+                         for name, values in self.snapshot().items())
+
+
+def endpoint_name(method: str, url: str) -> str:
+    path = urlparse(url).path
+    return ENDPOINT_NAMES.get((method, path), f'{method} {path}')
+
+
+def latency_hook(tracker: LatencyTracker):
+    """requests response hook recording the exchange latency of every call.
+
+    response.elapsed runs from sending the request until the response headers
+    are parsed, so it excludes our own time spent processing the body.
+    """
+    def hook(response, *args, **kwargs):
+        tracker.observe(endpoint_name(response.request.method, response.request.url),
+                        response.elapsed.total_seconds() * 1000)
+    return hook
+
+
+# Latency of every Binance REST call made through binance_client()
+api_latency = LatencyTracker()
+
+
+class StageMetrics:
+    """Stage timings and event counters, exported as a Prometheus textfile or JSON.
+
+    timer(stage) records the wall time of a block in milliseconds and
+    count(event) adds to a counter; both are cheap enough for the hot path
+    and safe to call from several threads.
+    """
+
+    def __init__(self, prefix: str = 'jupiter', window: int = 1024):
+        self.prefix = prefix
+        self.timings = LatencyTracker(window)
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.observe(stage, (time.perf_counter() - start) * 1000)
+
+    def count(self, event: str, n: int = 1):
+        with self._lock:
+            self.counters[event] = self.counters.get(event, 0) + n
+
+    def snapshot(self, latency: LatencyTracker = None) -> dict:
+        with self._lock:
+            counters = dict(sorted(self.counters.items()))
+        snapshot = {'timestamp': time.time(), 'counters': counters,
+                    'stages_ms': self.timings.snapshot()}
+        if latency is not None:
+            snapshot['api_latency_ms'] = latency.snapshot()
+        return snapshot
+
+    def prometheus(self, latency: LatencyTracker = None) -> str:
+        """Counters and summaries (in seconds) in the Prometheus text format"""
+        snapshot = self.snapshot(latency)
+        lines = [f'# TYPE {self.prefix}_events_total counter']
+        lines += [f'{self.prefix}_events_total{{event="{event}"}} {n}'
+                  for event, n in snapshot['counters'].items()]
+        for metric, label, key in (('stage_seconds', 'stage', 'stages_ms'),
+                                   ('api_latency_seconds', 'endpoint', 'api_latency_ms')):
+            if key not in snapshot:
+                continue
+            name = f'{self.prefix}_{metric}'
+            lines.append(f'# TYPE {name} summary')
+            for value, summary in snapshot[key].items():
+                for q in PERCENTILES:
+                    lines.append(f'{name}{{{label}="{value}",quantile="{q / 100}"}} {summary[f"p{q}"] / 1000}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {summary["sum"] / 1000}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {summary["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str, latency: LatencyTracker = None):
+        """Write a JSON snapshot (.json) or a Prometheus textfile (anything else), atomically"""
+        if path.endswith('.json'):
+            content = json.dumps(self.snapshot(latency), indent=2)
+        else:
+            content = self.prometheus(latency)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+
+# Stage timings of the live engine and the backtests
+stage_metrics = StageMetrics()
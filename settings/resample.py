@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+from settings.klines import BASE_INTERVAL, interval_ms
+from settings.buffer import KlineBuffer, concat_arrays
+
+
+# How each column of a longer candle is built from the candles it spans
+AGGREGATIONS = {
+    'open': 'first',
+    'high': 'max',
+    'low': 'min',
+    'close': 'last',
+    'volume': 'sum'
+}
+
+# Binance weekly candles open on Monday, the epoch was a Thursday
+WEEK_MS = interval_ms('1w')
+WEEK_OFFSET_MS = 4 * interval_ms('1d')
+
+
+def resample_factor(interval: str, base: str = BASE_INTERVAL) -> int:
+    """Number of base candles in one interval candle"""
+    step, base_step = interval_ms(interval), interval_ms(base)
+    if step % base_step:
+        raise ValueError(f'{interval} is not a multiple of {base}')
+    return step // base_step
+
+
+def bucket_start(open_time: np.ndarray, step: int) -> np.ndarray:
+    """Open time of the interval candle each base candle belongs to, aligned like Binance"""
+    offset = WEEK_OFFSET_MS if step % WEEK_MS == 0 else 0
+    return (open_time - offset) // step * step + offset
+
+
+def aggregate(data: dict[str, np.ndarray], step: int, time_key: str = 'open_time') -> dict[str, np.ndarray]:
+    """Aggregate time-ordered base candles into interval candles in one pass.
+
+    Columns not listed in AGGREGATIONS are left out, except close_time,
+    which becomes the last millisecond of each interval candle. Adds a
+    'last_open' array with the open time of the last base candle of each
+    interval candle, to tell complete candles from partial ones.
+    """
+    open_time = np.asarray(data[time_key])
+    buckets = bucket_start(open_time, step)
+    starts = np.flatnonzero(np.diff(buckets, prepend=buckets[:1] - 1))
+    ends = np.append(starts[1:], len(buckets)) - 1
+
+    result = {time_key: buckets[starts]}
+    for column, how in AGGREGATIONS.items():
+        if column not in data:
+            continue
+        values = np.asarray(data[column])
+        if how == 'first':
+            result[column] = values[starts]
+        elif how == 'last':
+            result[column] = values[ends]
+        elif how == 'max':
+            result[column] = np.maximum.reduceat(values, starts)
+        elif how == 'min':
+            result[column] = np.minimum.reduceat(values, starts)
+        else:
+            result[column] = np.add.reduceat(values, starts)
+    if 'close_time' in data:
+        result['close_time'] = result[time_key] + step - 1
+    result['last_open'] = open_time[ends]
+    return result
+
+
+def resample_ohlcv(data: dict[str, np.ndarray], interval: str, base: str = BASE_INTERVAL,
+                   time_key: str = 'open_time', complete: bool = True) -> dict[str, np.ndarray]:
+    """Build interval candles out of base candle arrays (e.g. KlineCache.read) in one vectorized pass.
+
+    With complete, a first candle missing its opening base candles and a
+    last one whose base candles have not all closed are dropped. Candles in
+    between are kept even when the base data has holes, like the exchange
+    does.
+    """
+    step, base_step = resample_factor(interval, base) * interval_ms(base), interval_ms(base)
+    if len(data[time_key]) == 0:
+        return {column: np.asarray(values)[:0] for column, values in data.items()
+                if column == time_key or column == 'close_time' or column in AGGREGATIONS}
+
+    result = aggregate(data, step, time_key)
+    last_open = result.pop('last_open')
+    keep = np.ones(len(last_open), dtype=bool)
+    if complete:
+        keep[0] &= bucket_start(np.asarray(data[time_key][:1]), step)[0] == np.asarray(data[time_key][:1])[0]
+        keep[-1] &= last_open[-1] + base_step == result[time_key][-1] + step
+    return {column: values[keep] for column, values in result.items()}
+
+
+def resample_frame(df: pd.DataFrame, interval: str, base: str = BASE_INTERVAL, complete: bool = True) -> pd.DataFrame:
+    """resample_ohlcv for a timestamp-indexed frame such as load_klines returns"""
+    if interval == base:
+        return df
+    data = {column: df[column].to_numpy() for column in df.columns if column in AGGREGATIONS}
+    data['open_time'] = df.index.to_numpy(dtype='datetime64[ms]').astype(np.int64)
+    result = resample_ohlcv(data, interval, base, complete=complete)
+    index = pd.to_datetime(result.pop('open_time'), unit='ms')
+    index.name = df.index.name
+    return pd.DataFrame(result, index=index)[[column for column in df.columns if column in result]]
+
+
+class Resampler:
+    """Incremental resampling of closed base candles into a KlineBuffer of interval candles.
+
+    update() is given the closed base candles (e.g. a base KlineBuffer) after
+    every top-up and only aggregates the ones it has not seen. An interval
+    candle is buffered once its last base candle closed; until then it is
+    kept as a partial candle. When the base candles no longer reach back to
+    the last one seen, everything is built again from them, starting with
+    the first interval candle they cover entirely.
+    """
+
+    def __init__(self, interval: str, base: str = BASE_INTERVAL, size: int = 500):
+        self.interval = interval
+        self.base = base
+        self.base_step = interval_ms(base)
+        self.step = resample_factor(interval, base) * self.base_step
+        self.buffer = KlineBuffer(interval, size)
+        self.partial = None
+        self.last_open = None
+        self.start = None
+
+    def _aggregate(self, candles: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        result = aggregate(candles, self.step, 'timestamp')
+        result.pop('last_open')
+        return result
+
+    def update(self, candles: dict[str, np.ndarray]) -> int:
+        """Aggregate the new closed base candles; returns the interval candles completed"""
+        timestamp = candles['timestamp']
+        if len(timestamp) == 0:
+            return 0
+        if self.last_open is None or timestamp[0] > self.last_open + self.base_step:
+            self.buffer.clear()
+            self.partial = None
+            # An interval candle that started before the base history is never complete
+            first = int(bucket_start(timestamp[:1], self.step)[0])
+            self.start = first if first == timestamp[0] else first + self.step
+            keep = timestamp >= self.start
+        else:
+            keep = (timestamp > self.last_open) & (timestamp >= self.start)
+        self.last_open = int(timestamp[-1])
+        new = {name: values[keep] for name, values in candles.items()}
+        if len(new['timestamp']) == 0:
+            return 0
+
+        parts = [new] if self.partial is None else [self.partial, new]
+        result = aggregate(concat_arrays(*parts), self.step, 'timestamp')
+        last_open = result.pop('last_open')
+
+        complete = np.ones(len(last_open), dtype=bool)
+        complete[-1] = last_open[-1] + self.base_step == result['timestamp'][-1] + self.step
+        self.partial = None if complete[-1] else {name: values[-1:] for name, values in result.items()}
+        return self.buffer.append({name: values[complete] for name, values in result.items()})
+
+    def arrays(self, forming: dict[str, np.ndarray] = None) -> dict[str, np.ndarray]:
+        """Buffered interval candles, with the partial one (and any forming base candles) last"""
+        if forming is not None and self.start is not None:
+            forming = {name: values[forming['timestamp'] >= self.start] for name, values in forming.items()}
+        parts = [part for part in (self.partial, forming) if part is not None and len(part['timestamp'])]
+        if not parts:
+            return self.buffer.arrays()
+        return concat_arrays(self.buffer.arrays(), self._aggregate(concat_arrays(*parts)))
@@ -1,104 +1,212 @@
 import time
+import logging
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 from binance.spot import Spot
+from settings.ratelimit import TokenBucket
+from settings.exchange import exchange_info
+from settings.account import AccountState
 
 
-def order_size(client: Spot, unit: str = 'USDC') -> float:
-    if unit == 'USDC':
-        balance = client.account()['balances'][50]['free']
-        if balance > 10:
-            size = float(balance) * 0.1
-        else:
-            size = 0.0
-    else:
-        for asset in client.account()['balances']:
-            if asset['asset'] == unit:
-                balance = float(asset['free'])
+def order_size(client: Spot, unit: str = 'USDC', account: AccountState = None) -> float:
+    # Read the balance from the iteration's account snapshot when there is one
+    account = (account or AccountState(client)).current()
+    balance = account.free(unit)
 
-                '''Hay que ajustar en base al precio del USD !!!!!'''
+    '''Hay que ajustar en base al precio del USD !!!!!'''
 
-                if balance > 10:
-                    size = balance * 0.1
-                else:
-                    size = 0.0
-                break
+    if balance > 10:
+        size = balance * 0.1
+    else:
+        size = 0.0
     return size
 
 
-def portfolio_value(client: Spot, units: str = 'USDC') -> float:
+# Assets tried as intermediate steps when a pair does not trade directly
+CONVERSION_HUBS = ('USDT', 'BTC')
+
+
+def price_map(client: Spot) -> dict[str, float]:
+    # Every ticker price in one request
+    return {ticker['symbol']: float(ticker['price']) for ticker in client.ticker_price()}
+
+
+def pair_rate(prices: dict, asset: str, target: str) -> float:
+    # Direct (ASSETTARGET) or inverse (TARGETASSET) pair, None when neither trades
+    if asset == target:
+        return 1.0
+    if prices.get(f'{asset}{target}'):
+        return prices[f'{asset}{target}']
+    if prices.get(f'{target}{asset}'):
+        return 1.0 / prices[f'{target}{asset}']
+    return None
+
+
+def conversion_rate(prices: dict, asset: str, target: str, hubs: tuple = CONVERSION_HUBS) -> float:
+    """Price of asset in target from a price map, through one hub asset if needed"""
+    rate = pair_rate(prices, asset, target)
+    if rate is not None:
+        return rate
+    for hub in hubs:
+        first, second = pair_rate(prices, asset, hub), pair_rate(prices, hub, target)
+        if first is not None and second is not None:
+            return first * second
+    return None
+
+
+def portfolio_value(client: Spot, units: str = 'USDC', account: AccountState = None, prices: dict = None,
+                    logger: logging.Logger = None) -> float:
+    """Value of every balance in units; assets without a price are logged and left out"""
+    logger = logger or logging.getLogger(__name__)
     total = 0.0
-    balances = client.account(omitZeroBalances='true')['balances']
-    for asset in balances:
-        if asset['asset'] != units:
-            try:
-                total += (float(asset['free']) + float(asset['locked'])) * float(
-                    client.ticker_price(symbol=f'{asset['asset']}{units}')['price'])
-            except Exception as e:
-                try:
-                    total += (float(asset['free']) + float(asset['locked'])) * float(
-                        client.ticker_price(symbol=f'{units}{asset['asset']}')['price'])
-                except Exception as e:
-                    print(asset['asset'])
-        else:
-            total += (float(asset['free']) + float(asset['locked']))
+    account = (account or AccountState(client)).current()
+    prices = prices if prices is not None else price_map(client)
+    for asset in account.balances:
+        rate = conversion_rate(prices, asset, units)
+        if rate is None:
+            logger.warning('No price to convert %s to %s', asset, units)
+            continue
+        total += account.total(asset) * rate
     return total
 
 
-def liquidate_account(client: Spot, target_quote: str = 'USDC'):
-    # Get current balances
-    balances = client.account(omitZeroBalances='true')['balances']
-    symbols_info = client.exchange_info()['symbols']
-    valid_symbols = {s['symbol']
-        : s for s in symbols_info if s['status'] == 'TRADING'}
+def round_step(quantity: float, step) -> str:
+    # Round down to a multiple of the filter step, formatted without exponent
+    step = Decimal(str(step))
+    if step == 0:
+        return format(Decimal(str(quantity)), 'f')
+    return format((Decimal(str(quantity)) // step * step).normalize(), 'f')
+
 
-    for asset in balances:
-        asset_name = asset['asset']
-        free_amount = float(asset['free'])
+def split_quantity(quantity: str, max_qty: str) -> list[str]:
+    """Chunks of at most max_qty adding up to quantity, the remainder last"""
+    quantity, max_qty = Decimal(quantity), Decimal(max_qty)
+    if max_qty <= 0 or quantity <= max_qty:
+        return [format(quantity, 'f')]
+    full, rest = divmod(quantity, max_qty)
+    chunks = [max_qty] * int(full) + ([rest] if rest > 0 else [])
+    return [format(chunk.normalize(), 'f') for chunk in chunks]
+
+
+def liquidation_orders(account: AccountState, info, prices: dict, target_quote: str = 'USDC') -> tuple:
+    """Valid market orders turning every free balance into target_quote, and the skipped assets.
+
+    Quantities are rounded down to the market lot step (or to the quote
+    precision for quoteOrderQty), split into orders of at most the market
+    maxQty and checked against minQty and the minimum notional, so dust is
+    skipped before anything is sent. Sells without a price are skipped too,
+    their notional cannot be checked.
+    """
+    orders, skipped = [], []
+    for asset, balance in account.balances.items():
+        free_amount = balance['free']
 
         # Skip quote currencies and zero balances
-        if asset_name in [target_quote, 'USDT', 'USDC'] or free_amount <= 0:
+        if asset in [target_quote, 'USDT', 'USDC'] or free_amount <= 0:
             continue
 
-        # Try to sell ASSETTARGET (e.g. BTCUSDC)
-        direct_symbol = f'{asset_name}{target_quote}'
-        reverse_symbol = f'{target_quote}{asset_name}'
-
-        if direct_symbol in valid_symbols:
-            try:
-                client.new_order(
-                    symbol=direct_symbol,
-                    side='SELL',
-                    type='MARKET',
-                    quantity=free_amount
-                )
-                print(
-                    f'Sold {asset_name} for {target_quote} via {direct_symbol}')
-                continue
-            except Exception as e:
-                print(f'Error selling {direct_symbol}')
-
-        elif reverse_symbol in valid_symbols:
-            try:
-                client.new_order(
-                    symbol=reverse_symbol,
-                    side='BUY',
-                    type='MARKET',
-                    quoteOrderQty=free_amount
-                )
+        # Try to sell ASSETTARGET (e.g. BTCUSDC), else buy TARGETASSET
+        direct_symbol = f'{asset}{target_quote}'
+        reverse_symbol = f'{target_quote}{asset}'
+
+        if info.is_trading(direct_symbol):
+            lot = info.lot_size(direct_symbol, market=True) or {'minQty': 0.0, 'maxQty': 0.0, 'stepSize': 0.0}
+            price = prices.get(direct_symbol)
+            if not price:
+                skipped.append({'asset': asset, 'symbol': direct_symbol, 'reason': 'no price'})
                 continue
-            except Exception as e:
-                print(f'Error buying {reverse_symbol}')
+            quantity = round_step(free_amount, lot['stepSize'])
+            for chunk in split_quantity(quantity, round_step(lot['maxQty'], lot['stepSize'])):
+                if float(chunk) < lot['minQty'] or float(chunk) <= 0:
+                    skipped.append({'asset': asset, 'symbol': direct_symbol, 'quantity': chunk,
+                                    'reason': 'below LOT_SIZE'})
+                elif float(chunk) * price < info.min_notional(direct_symbol):
+                    skipped.append({'asset': asset, 'symbol': direct_symbol, 'quantity': chunk,
+                                    'reason': 'below MIN_NOTIONAL'})
+                else:
+                    orders.append({'asset': asset, 'symbol': direct_symbol, 'side': 'SELL',
+                                   'type': 'MARKET', 'quantity': chunk})
+        elif info.is_trading(reverse_symbol):
+            lot = info.lot_size(reverse_symbol, market=True)
+            price = prices.get(reverse_symbol)
+            precision = info.symbol(reverse_symbol).get('quoteAssetPrecision', 8)
+            step = f'1e-{precision}'
+            quote_qty = round_step(free_amount, step)
+            # maxQty limits the bought quantity, unsplit when there is no price to convert it
+            max_quote = round_step(lot['maxQty'] * price, step) if lot and price else '0'
+            for chunk in split_quantity(quote_qty, max_quote):
+                if float(chunk) <= 0 or float(chunk) < info.min_notional(reverse_symbol):
+                    skipped.append({'asset': asset, 'symbol': reverse_symbol, 'quoteOrderQty': chunk,
+                                    'reason': 'below MIN_NOTIONAL'})
+                else:
+                    orders.append({'asset': asset, 'symbol': reverse_symbol, 'side': 'BUY',
+                                   'type': 'MARKET', 'quoteOrderQty': chunk})
         else:
-            print(
-                f'No available pair to convert {asset_name} to {target_quote}')
+            skipped.append({'asset': asset, 'symbol': None,
+                            'reason': f'no pair to convert to {target_quote}'})
+    return orders, skipped
+
+
+def liquidate_account(client: Spot, target_quote: str = 'USDC', max_workers: int = 10,
+                      logger: logging.Logger = None) -> dict:
+    """Sell every free balance into target_quote and report what happened.
+
+    Orders are prepared from a single account snapshot, price map and the
+    cached exchange filters, then sent concurrently while a token bucket
+    keeps them within the exchange's order rate limit. Returns the filled,
+    failed and skipped orders along with the elapsed seconds.
+    """
+    logger = logger or logging.getLogger(__name__)
+    start = time.time()
+    info = exchange_info(client)
+    account = AccountState(client).refresh()
+    orders, skipped = liquidation_orders(account, info, price_map(client), target_quote)
+
+    rate, burst = info.order_rate()
+    budget = TokenBucket(rate, burst)
+
+    def submit(order: dict) -> dict:
+        budget.acquire()
+        params = {key: value for key, value in order.items() if key != 'asset'}
+        try:
+            response = client.new_order(**params)
+            return {**order, 'status': response.get('status', 'FILLED'),
+                    'executedQty': response.get('executedQty'),
+                    'cummulativeQuoteQty': response.get('cummulativeQuoteQty')}
+        except Exception as e:
+            return {**order, 'status': 'ERROR', 'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(submit, orders))
+
+    report = {
+        'filled': [result for result in results if result['status'] != 'ERROR'],
+        'failed': [result for result in results if result['status'] == 'ERROR'],
+        'skipped': skipped,
+        'elapsed': time.time() - start
+    }
+    for result in report['failed']:
+        logger.error('Error liquidating %s via %s: %s',
+                     result['asset'], result['symbol'], result['error'])
+    logger.info('Liquidated %d assets into %s in %.2f s (%d failed, %d skipped)',
+                len(report['filled']), target_quote, report['elapsed'],
+                len(report['failed']), len(skipped))
+    return report
+
 
+def check_ping(client: Spot, logger: logging.Logger = None) -> float:
+    """Round trip of a ping in milliseconds, None when it failed.
 
-def check_ping(client: Spot) -> float:
+    Only logged here; with a binance_client() the call is also recorded in
+    api_latency under 'ping'.
+    """
+    logger = logger or logging.getLogger(__name__)
     try:
         initial = time.time()
         client.ping()
-        final = time.time()
-        latency = (final - initial) * 1000
-        print(f'Ping successful: {latency:.2f} ms')
+        latency = (time.time() - initial) * 1000
+        logger.debug('Ping successful: %.2f ms', latency)
         return latency
     except Exception as e:
-        print(f'Ping failed: {e}')
+        logger.warning('Ping failed: %s', e)
+        return None
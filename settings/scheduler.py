@@ -0,0 +1,99 @@
+import time
+import logging
+from binance.spot import Spot
+from settings.klines import interval_ms
+from settings.resample import bucket_start
+from settings.metrics import stage_metrics
+
+
+# Seconds after a candle close before waking up, so the exchange has closed it
+WAKE_OFFSET = 2.0
+
+# Seconds between server time synchronisations
+TIME_SYNC_EVERY = 3600
+
+
+class CandleScheduler:
+    """Run jobs a fixed offset after every exchange candle close, for several intervals.
+
+    Candle boundaries are computed on the exchange clock, estimated from
+    client.time() and corrected for half the round trip, and aligned like the
+    exchange's candles (weeks close on Monday 00:00 UTC). Each job is called
+    with the close boundary in ms, which is the open_time of the next candle.
+    If a run overruns past later closes of its interval, the job runs again
+    right away for the latest close and the skipped ones are logged and
+    counted, instead of the schedule drifting.
+    """
+
+    def __init__(self, client: Spot, wake_offset: float = WAKE_OFFSET, time_sync_every: float = TIME_SYNC_EVERY,
+                 logger: logging.Logger = None):
+        self.client = client
+        self.wake_offset = wake_offset
+        self.time_sync_every = time_sync_every
+        self.logger = logger or logging.getLogger(__name__)
+        self.offset_ms = 0.0
+        self.synced_at = None
+        self.jobs = []
+        self.running = False
+
+    def sync_time(self):
+        """Estimate the offset between the exchange clock and ours"""
+        before = time.time() * 1000
+        server = self.client.time()['serverTime']
+        after = time.time() * 1000
+        self.offset_ms = server - (before + after) / 2
+        self.synced_at = time.time()
+        self.logger.info('Server time offset %.1f ms (round trip %.1f ms)',
+                         self.offset_ms, after - before)
+
+    def now_ms(self) -> float:
+        """Current exchange time in milliseconds"""
+        if self.synced_at is None or time.time() - self.synced_at > self.time_sync_every:
+            try:
+                self.sync_time()
+            except Exception as e:
+                self.logger.warning('Server time sync failed, keeping offset %.1f ms: %s',
+                                    self.offset_ms, e)
+                self.synced_at = time.time()
+        return time.time() * 1000 + self.offset_ms
+
+    def add(self, interval: str, job):
+        """Call job(close_time) after every close of interval, starting with the next one"""
+        step = interval_ms(interval)
+        self.jobs.append({'interval': interval, 'step': step, 'job': job,
+                          'next_close': bucket_start(int(self.now_ms()), step) + step})
+
+    def run_pending(self) -> list:
+        """Run every job whose close (plus the wake offset) has passed; returns the intervals run"""
+        ran = []
+        # Longer intervals last, so a 1h job sees the 5m job of the same close done
+        for entry in sorted(self.jobs, key=lambda entry: entry['step']):
+            now = self.now_ms()
+            if now < entry['next_close'] + self.wake_offset * 1000:
+                continue
+            latest = bucket_start(int(now - self.wake_offset * 1000), entry['step'])
+            missed = (latest - entry['next_close']) // entry['step']
+            if missed > 0:
+                self.logger.warning('%s schedule overran, skipping %d closes to catch up',
+                                    entry['interval'], missed)
+                stage_metrics.count(f'missed_closes_{entry["interval"]}', missed)
+            entry['next_close'] = latest + entry['step']
+            entry['job'](latest)
+            ran.append(entry['interval'])
+        return ran
+
+    def seconds_until_next(self) -> float:
+        if not self.jobs:
+            return self.time_sync_every
+        due = min(entry['next_close'] for entry in self.jobs) + self.wake_offset * 1000
+        return max(0.0, (due - self.now_ms()) / 1000)
+
+    def run(self):
+        """Run jobs until stop() is called"""
+        self.running = True
+        while self.running:
+            time.sleep(self.seconds_until_next())
+            self.run_pending()
+
+    def stop(self):
+        self.running = False
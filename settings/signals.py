@@ -0,0 +1,55 @@
+import numpy as np
+
+
+# Signal codes shared by the backtest and the live engine
+BUY = 1
+SELL = -1
+LABELS = {BUY: 'BUY', SELL: 'SELL', 0: ''}
+
+
+def indicators_ready(rsi_values: np.ndarray, macd_line: np.ndarray, signal_line: np.ndarray) -> np.ndarray:
+    """Candles where every indicator has warmed up and a previous candle exists"""
+    ready = ~(np.isnan(rsi_values) | np.isnan(macd_line) | np.isnan(signal_line))
+    if ready.shape[-1]:
+        ready[..., 0] = False
+    return ready
+
+
+def crossover_signals(rsi_values: np.ndarray, macd_line: np.ndarray, signal_line: np.ndarray,
+                      rsi_oversold: float = 30, rsi_overbought: float = 70) -> np.ndarray:
+    """Ananke signal codes (BUY, SELL or 0) for every candle, along the last axis.
+
+    BUY when RSI is oversold and MACD crosses above its signal line, SELL when
+    RSI is overbought and MACD crosses below it.
+    """
+    macd_above = macd_line > signal_line
+    macd_cross_up = np.zeros_like(macd_above)
+    macd_cross_down = np.zeros_like(macd_above)
+    macd_cross_up[..., 1:] = macd_above[..., 1:] & ~macd_above[..., :-1]
+    macd_cross_down[..., 1:] = ~macd_above[..., 1:] & macd_above[..., :-1]
+
+    ready = indicators_ready(rsi_values, macd_line, signal_line)
+    with np.errstate(invalid='ignore'):
+        buy = ready & (rsi_values < rsi_oversold) & macd_cross_up
+        sell = ready & ~buy & (rsi_values > rsi_overbought) & macd_cross_down
+
+    codes = np.zeros(macd_above.shape, dtype=np.int8)
+    codes[buy] = BUY
+    codes[sell] = SELL
+    return codes
+
+
+def signal_labels(codes: np.ndarray) -> np.ndarray:
+    """Turn signal codes into the 'BUY'/'SELL'/'' labels used in DataFrames"""
+    labels = np.full(codes.shape, '', dtype=object)
+    labels[codes == BUY] = LABELS[BUY]
+    labels[codes == SELL] = LABELS[SELL]
+    return labels
+
+
+def signal_codes(labels: np.ndarray) -> np.ndarray:
+    """Turn 'BUY'/'SELL'/'' labels back into signal codes"""
+    codes = np.zeros(len(labels), dtype=np.int8)
+    codes[labels == LABELS[BUY]] = BUY
+    codes[labels == LABELS[SELL]] = SELL
+    return codes
@@ -0,0 +1,123 @@
+import json
+import time
+import queue
+import logging
+from binance.websocket.spot.websocket_stream import SpotWebsocketStreamClient
+from settings.klines import interval_ms
+from settings.buffer import KlineBuffer, kline_arrays, slice_arrays
+
+
+# Binance allows 1024 streams per connection; subscriptions are sent in smaller batches
+STREAMS_PER_CONNECTION = 1024
+STREAMS_PER_MESSAGE = 200
+
+
+def kline_row(k: dict) -> list:
+    """Turn a kline stream payload into the row layout of the REST klines endpoint"""
+    return [k['t'], k['o'], k['h'], k['l'], k['c'], k['v'],
+            k['T'], k['q'], k['n'], k['V'], k['Q'], k['B']]
+
+
+class KlineStream:
+    """Kline WebSocket streams for a symbol universe with a KlineBuffer per symbol.
+
+    Buffers are seeded once with REST klines and then extended by the
+    stream. Whenever a candle closes, (symbol, candles) is put on the closed
+    queue, candles being a copy of the buffered arrays with the just-closed
+    candle last.
+    Messages arrive on the socket threads; consumers read the queue from
+    their own thread, so signals and orders are handled one at a time.
+    A symbol whose buffer missed candles is reported in gaps and left out
+    until it is seeded again.
+    """
+
+    def __init__(self, stream_url: str, interval: str = '5m', buffer_size: int = 500,
+                 logger: logging.Logger = None):
+        self.stream_url = stream_url
+        self.interval = interval
+        self.step = interval_ms(interval)
+        self.buffer_size = buffer_size
+        self.logger = logger or logging.getLogger(__name__)
+        self.buffers = {}
+        self.gaps = set()
+        self.closed = queue.Queue()
+        self.clients = []
+        self.symbols = []
+        self.last_message = time.time()
+
+    def seed(self, symbol: str, klines: list, now: int = None):
+        """Fill the buffer of a symbol with REST klines; a still-forming last candle is dropped.
+
+        now (ms) is when the klines were requested, default now: a candle
+        closing after it may have been sent before it was complete, and is
+        left to its close message instead.
+        """
+        candles = kline_arrays(klines)
+        now = int(time.time() * 1000) if now is None else now
+        buffer = KlineBuffer(self.interval, self.buffer_size)
+        buffer.append(slice_arrays(candles, candles['close_time'] < now))
+        # Swapped in whole, the socket threads never see a half-seeded buffer
+        self.buffers[symbol] = buffer
+        self.gaps.discard(symbol)
+
+    def on_message(self, _, message: str):
+        data = json.loads(message)
+        # Combined streams wrap the payload, subscription replies carry no kline
+        data = data.get('data', data)
+        if data.get('e') != 'kline':
+            return
+        self.last_message = time.time()
+        k = data['k']
+        if not k['x']:
+            return
+
+        symbol = data['s']
+        buffer = self.buffers.get(symbol)
+        if buffer is None or symbol in self.gaps:
+            return
+        open_time = k['t']
+        if buffer.count and open_time <= buffer.last_open_time:
+            return
+        if buffer.count and open_time != buffer.next_open_time:
+            self.logger.warning('Missed %s candles before %s, waiting for a new seed',
+                                symbol, open_time)
+            self.gaps.add(symbol)
+            return
+        buffer.append(kline_arrays([kline_row(k)]))
+        # The buffer keeps changing on this thread, consumers get their own copy
+        self.closed.put((symbol, {name: values.copy() for name, values in buffer.arrays().items()}))
+
+    def on_error(self, _, error):
+        self.logger.error('Kline stream error: %s', error)
+
+    def start(self, symbols: list):
+        """Open as many connections as needed and subscribe to every symbol"""
+        self.symbols = list(symbols)
+        self.last_message = time.time()
+        for lo in range(0, len(self.symbols), STREAMS_PER_CONNECTION):
+            client = SpotWebsocketStreamClient(stream_url=self.stream_url, is_combined=True,
+                                               on_message=self.on_message, on_error=self.on_error)
+            group = self.symbols[lo:lo + STREAMS_PER_CONNECTION]
+            for k in range(0, len(group), STREAMS_PER_MESSAGE):
+                streams = [f'{symbol.lower()}@kline_{self.interval}'
+                           for symbol in group[k:k + STREAMS_PER_MESSAGE]]
+                client.subscribe(streams, id=len(self.clients) * 1000 + k // STREAMS_PER_MESSAGE + 1)
+                # Stay below the limit of 5 incoming messages per second
+                time.sleep(0.25)
+            self.clients.append(client)
+        self.logger.info('Subscribed to %d kline streams on %d connections',
+                         len(self.symbols), len(self.clients))
+
+    def stop(self):
+        for client in self.clients:
+            client.stop()
+        self.clients = []
+
+    def restart(self):
+        """Reconnect every stream, e.g. after the connection went quiet"""
+        self.stop()
+        self.start(self.symbols)
+
+    def stale(self, timeout: float) -> bool:
+        """True when no kline message arrived for timeout seconds"""
+        return time.time() - self.last_message > timeout
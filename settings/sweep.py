@@ -0,0 +1,142 @@
+import itertools
+import logging
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from settings import indicators
+from settings import signals
+from settings import backtest
+
+
+# Strategy parameters and their current values
+DEFAULT_PARAMS = {
+    'rsi_window': 14,
+    'rsi_oversold': 30,
+    'rsi_overbought': 70,
+    'macd_fast': 12,
+    'macd_slow': 26,
+    'macd_signal': 9,
+    **backtest.EXIT_RULES
+}
+
+# Parameters that change the signals; the rest only change the exits
+SIGNAL_PARAMS = ('rsi_window', 'rsi_oversold', 'rsi_overbought',
+                 'macd_fast', 'macd_slow', 'macd_signal')
+
+# Data shared by every configuration, set once per worker process
+_shared = {}
+
+
+def parameter_grid(**values) -> list[dict]:
+    """Every combination of the given parameter values, on top of DEFAULT_PARAMS"""
+    unknown = set(values) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f'Unknown sweep parameters: {sorted(unknown)}')
+    names = list(values)
+    return [{**DEFAULT_PARAMS, **dict(zip(names, combo))}
+            for combo in itertools.product(*(values[name] for name in names))]
+
+
+def signal_key(config: dict) -> tuple:
+    return tuple(config[name] for name in SIGNAL_PARAMS)
+
+
+def build_signal_sets(closes: list, configs: list[dict], chunk_size: int = 32) -> dict[tuple, list]:
+    """Signal codes per symbol for every distinct signal configuration.
+
+    Each RSI window and each MACD (fast, slow, signal) triple is computed
+    once for all symbols with the batch kernels and shared by every
+    configuration that uses it.
+    """
+    keys = list(dict.fromkeys(signal_key(config) for config in configs))
+    rsi_cache, macd_cache = {}, {}
+    signal_sets = {}
+    for key in keys:
+        params = dict(zip(SIGNAL_PARAMS, key))
+        window = params['rsi_window']
+        periods = (params['macd_fast'], params['macd_slow'],
+                   params['macd_signal'])
+
+        if window not in rsi_cache:
+            rsi_cache[window] = indicators.batch_apply(
+                closes, lambda prices: indicators.rsi_batch(prices, window), chunk_size)
+        if periods not in macd_cache:
+            macd_cache[periods] = indicators.batch_apply(
+                closes, lambda prices: indicators.macd_batch(prices, *periods), chunk_size)
+
+        signal_sets[key] = [
+            signals.crossover_signals(rsi_values, macd['macd_line'], macd['signal_line'],
+                                      params['rsi_oversold'], params['rsi_overbought'])
+            for rsi_values, macd in zip(rsi_cache[window], macd_cache[periods])
+        ]
+    return signal_sets
+
+
+def _init_worker(shared: dict):
+    _shared.clear()
+    _shared.update(shared)
+
+
+def _evaluate(config: dict) -> dict:
+    """Run the portfolio backtest for one configuration on the shared data"""
+    balance = _shared['initial_balance']
+    positions = backtest.PositionBook(_shared['symbols'])
+    trade_history = backtest.TradeLedger()
+    logger = _shared['logger']
+    exit_rules = {name: config[name] for name in backtest.EXIT_RULES}
+
+    balance, positions, trade_history = backtest.simulate_portfolio(
+        _shared['symbols'], _shared['can_open'], _shared['times'], _shared['closes'],
+        _shared['signal_sets'][signal_key(config)], balance, positions, trade_history,
+        _shared['risk_per_trade'], logger, exit_rules, _shared['atrs'])
+    balance, positions, trade_history = backtest.close_all_positions(
+        _shared['frames'], balance, positions, trade_history, logger)
+
+    metrics = backtest.calculate_metrics(
+        _shared['initial_balance'], balance, trade_history, False, logger)
+    return {**config, **metrics}
+
+
+def run_sweep(dfs: dict[str, pd.DataFrame], symbol_order: list, configs: list[dict], initial_balance: float = 100.0,
+              risk_per_trade: float = 0.1, workers: int = 1, rank_by: str = 'total_return',
+              logger: logging.Logger = None) -> pd.DataFrame:
+    """Backtest every configuration on the same data and rank the results.
+
+    dfs holds the close prices of every symbol, plus their atr column when
+    sweeping the ATR stop (as loaded for test_ananke);
+    indicators and signals are computed once per distinct setting and shared
+    across configurations, which are evaluated on a process pool when
+    workers > 1. Returns one row per configuration with its parameters and
+    metrics, best first.
+    """
+    logger = logger or logging.getLogger(__name__)
+    symbols, can_open, times, closes, _ = backtest.portfolio_arrays(
+        {symbol: df.assign(signal='') for symbol, df in dfs.items()}, symbol_order)
+
+    shared = {
+        'symbols': symbols,
+        'can_open': can_open,
+        'times': times,
+        'closes': closes,
+        'atrs': [dfs[symbol]['atr'].to_numpy(dtype=float) if 'atr' in dfs[symbol] else None
+                 for symbol in symbols],
+        'signal_sets': build_signal_sets(closes, configs),
+        'frames': {symbol: dfs[symbol][['close']] for symbol in symbols},
+        'initial_balance': initial_balance,
+        'risk_per_trade': risk_per_trade,
+        'logger': logger
+    }
+    logger.info('Sweeping %d configurations (%d distinct signal settings) over %d symbols',
+                len(configs), len(shared['signal_sets']), len(symbols))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared,)) as pool:
+            results = list(pool.map(_evaluate, configs,
+                           chunksize=max(1, len(configs) // (4 * workers))))
+    else:
+        _init_worker(shared)
+        results = [_evaluate(config) for config in configs]
+
+    table = pd.DataFrame(results).sort_values(
+        rank_by, ascending=False, kind='stable').reset_index(drop=True)
+    table.insert(0, 'rank', range(1, len(table) + 1))
+    return table
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+
+# Shapes of synthetic price series
+KINDS = ('random_walk', 'trend', 'regime')
+
+
+def synthetic_returns(rng: np.random.Generator, length: int, kind: str) -> np.ndarray:
+    """Log returns per candle for one series of the given kind"""
+    if kind == 'random_walk':
+        return rng.normal(0.0, 0.002, length)
+    if kind == 'trend':
+        drift = rng.choice([-1, 1]) * rng.uniform(2e-5, 1e-4)
+        return rng.normal(drift, 0.002, length)
+    if kind == 'regime':
+        # Two-state Markov chain: calm and drifting up, or volatile and drifting down
+        switches = rng.random(length) < 1 / 500
+        state = np.cumsum(switches) % 2
+        drift = np.where(state == 0, 5e-5, -8e-5)
+        vol = np.where(state == 0, 0.0015, 0.004)
+        return rng.normal(drift, vol)
+    raise ValueError(f'Unknown synthetic series kind: {kind}')
+
+
+def synthetic_ohlcv(length: int, kind: str = 'random_walk', seed: int = 0, start: str = '2024-01-01',
+                    freq: str = '5min', price: float = 100.0) -> pd.DataFrame:
+    """Deterministic OHLCV candles indexed by timestamp, like the klines table"""
+    rng = np.random.default_rng(seed)
+    close = price * np.exp(np.cumsum(synthetic_returns(rng, length, kind)))
+    open_ = np.concatenate([[price], close[:-1]])
+    spread = np.abs(rng.normal(0.0, 0.001, (2, length)))
+    df = pd.DataFrame({
+        'open': open_,
+        'high': np.maximum(open_, close) * (1 + spread[0]),
+        'low': np.minimum(open_, close) * (1 - spread[1]),
+        'close': close,
+        'volume': rng.lognormal(3.0, 1.0, length)
+    }, index=pd.date_range(start, periods=length, freq=freq, name='timestamp'))
+    return df
+
+
+def synthetic_universe(n_symbols: int, length: int, kind: str = 'random_walk', seed: int = 0,
+                       quote: str = 'USDC') -> dict[str, pd.DataFrame]:
+    """OHLCV frames for n_symbols made-up pairs; symbol i always gets the same series for a seed"""
+    return {f'SYN{i}{quote}': synthetic_ohlcv(length, kind, seed * 100003 + i,
+                                               price=float(10 ** (i % 5)))
+            for i in range(n_symbols)}
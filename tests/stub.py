@@ -0,0 +1,295 @@
+import json
+import time
+import base64
+import socket
+import struct
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+from binance.spot import Spot
+from settings.klines import interval_ms
+from settings.connect import tune_session
+from settings import synthetic
+
+
+# Filters of every stub symbol, loose enough for any test order
+STUB_FILTERS = [
+    {'filterType': 'PRICE_FILTER', 'minPrice': '0.01', 'maxPrice': '1000000', 'tickSize': '0.01'},
+    {'filterType': 'LOT_SIZE', 'minQty': '0.001', 'maxQty': '9000', 'stepSize': '0.001'},
+    {'filterType': 'NOTIONAL', 'minNotional': '5.0'}
+]
+
+
+def kline_rows(df: pd.DataFrame, step: int) -> list:
+    """Synthetic OHLCV candles in the row layout of the REST klines endpoint"""
+    open_time = df.index.to_numpy(dtype='datetime64[ms]').astype('int64')
+    return [[int(t), str(o), str(h), str(l), str(c), str(v), int(t) + step - 1, str(c * v), 1, '0', '0', '0']
+            for t, o, h, l, c, v in zip(open_time, df['open'], df['high'], df['low'], df['close'], df['volume'])]
+
+
+def recorded_klines(symbols: list, length: int, interval: str = '5m', end: int = None, seed: int = 0) -> dict[str, list]:
+    """length deterministic klines per symbol, the last one opening before end (ms, default now)"""
+    step = interval_ms(interval)
+    end = int(time.time() * 1000) if end is None else end
+    start = ((end - 1) // step - length + 1) * step
+    return {symbol: kline_rows(synthetic.synthetic_ohlcv(length, seed=seed * 100003 + i,
+                                                          start=pd.Timestamp(start, unit='ms'),
+                                                          freq=f'{step}ms'), step)
+            for i, symbol in enumerate(symbols)}
+
+
+class StubBinance:
+    """Local stand-in for the Binance REST endpoints the live engine calls.
+
+    Serves exchangeInfo, klines (startTime, endTime and limit like the real
+    endpoint, only candles opened by now), ping and time, each after latency
+    seconds, on a threaded server so concurrent clients overlap like against
+    the exchange. Requests are counted per path.
+    """
+
+    def __init__(self, symbols: list, history: int = 2000, interval: str = '5m', latency: float = 0.1,
+                 quote: str = 'USDC'):
+        self.symbols = list(symbols)
+        self.interval = interval
+        self.step = interval_ms(interval)
+        self.latency = latency
+        self.quote = quote
+        # A little room past now, so the forming candle exists while the server runs
+        self.klines = recorded_klines(self.symbols, history, interval,
+                                      int(time.time() * 1000) + 100 * self.step)
+        self.requests = {}
+        self._lock = threading.Lock()
+        self.server = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def exchange_info(self) -> dict:
+        return {'rateLimits': [], 'symbols': [
+            {'symbol': symbol, 'baseAsset': symbol[:-len(self.quote)], 'quoteAsset': self.quote,
+             'status': 'TRADING', 'filters': STUB_FILTERS} for symbol in self.symbols]}
+
+    def kline_page(self, query: dict) -> list:
+        rows = self.klines[query['symbol'][0]]
+        now = int(time.time() * 1000)
+        start = int(query.get('startTime', [0])[0])
+        end = min(int(query.get('endTime', [now])[0]), now)
+        limit = int(query.get('limit', [500])[0])
+        rows = [row for row in rows if start <= row[0] <= end]
+        return rows[:limit] if 'startTime' in query else rows[-limit:]
+
+    def respond(self, path: str, query: dict):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+        time.sleep(self.latency)
+        if path == '/api/v3/exchangeInfo':
+            return self.exchange_info()
+        if path == '/api/v3/klines':
+            return self.kline_page(query)
+        if path == '/api/v3/ping':
+            return {}
+        if path == '/api/v3/time':
+            return {'serverTime': int(time.time() * 1000)}
+        return None
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                body = stub.respond(url.path, parse_qs(url.query))
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def stub_client(stub: StubBinance, pool_size: int = 10) -> Spot:
+    """Spot client on the stub, with the session tuning of binance_client()"""
+    client = Spot(base_url=stub.base_url, timeout=10)
+    tune_session(client.session, pool_size)
+    return client
+
+
+# Key suffix of the WebSocket opening handshake (RFC 6455)
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def kline_message(symbol: str, interval: str, row: list, closed: bool) -> dict:
+    """Combined-stream kline event for a REST kline row"""
+    k = dict(zip('tohlcvTqnVQB', row))
+    k.update(s=symbol, i=interval, x=closed)
+    return {'stream': f'{symbol.lower()}@kline_{interval}',
+            'data': {'e': 'kline', 'E': row[6], 's': symbol, 'k': k}}
+
+
+class StubKlineStream:
+    """Local stand-in for the Binance combined kline streams, replaying recorded klines.
+
+    Speaks just enough WebSocket for the connector: the handshake, masked
+    client frames, pings and text frames. SUBSCRIBE requests are answered
+    like the exchange does; every subscribed symbol then gets its klines in
+    time order, each as an update of the forming candle followed by its
+    close, as far as release() allowed. Each connection replays from the
+    first kline, like a reconnect sees the candles again.
+    """
+
+    def __init__(self, klines: dict[str, list], interval: str = '5m'):
+        self.klines = klines
+        self.interval = interval
+        self.subscribed = []
+        self.released = 0
+        self._released = threading.Condition()
+        self.server = None
+        self.connections = []
+        self.replayed = set()
+
+    @property
+    def url(self) -> str:
+        return f'ws://127.0.0.1:{self.server.getsockname()[1]}'
+
+    def start(self):
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def release(self, count: int = None):
+        """Replay count more klines per symbol, all of them by default"""
+        with self._released:
+            if count is None:
+                self.released = max(map(len, self.klines.values()), default=0)
+            else:
+                self.released += count
+            self._released.notify_all()
+
+    def stop(self):
+        for conn, _ in self.connections:
+            try:
+                conn.close()
+            except OSError:
+                pass
+        self.server.close()
+        # Replays still waiting find their connection closed and end
+        self.release()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            lock = threading.Lock()
+            self.connections.append((conn, lock))
+            threading.Thread(target=self._serve, args=(conn, lock), daemon=True).start()
+
+    def _handshake(self, conn: socket.socket):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            request += conn.recv(4096)
+        key = next(line.split(b':', 1)[1].strip() for line in request.split(b'\r\n')
+                   if line.lower().startswith(b'sec-websocket-key'))
+        accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+        conn.sendall(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                     b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+
+    @staticmethod
+    def _recv_exactly(conn: socket.socket, n: int) -> bytes:
+        data = b''
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError('WebSocket client went away')
+            data += chunk
+        return data
+
+    def _read_frame(self, conn: socket.socket) -> tuple:
+        first, second = self._recv_exactly(conn, 2)
+        n = second & 127
+        if n == 126:
+            n = struct.unpack('>H', self._recv_exactly(conn, 2))[0]
+        elif n == 127:
+            n = struct.unpack('>Q', self._recv_exactly(conn, 8))[0]
+        mask = self._recv_exactly(conn, 4) if second & 128 else b'\0\0\0\0'
+        payload = self._recv_exactly(conn, n)
+        return first & 15, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    @staticmethod
+    def _send_frame(conn: socket.socket, lock: threading.Lock, payload: bytes, opcode: int = 1):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack('>BB', 128 | opcode, n)
+        elif n < 65536:
+            header = struct.pack('>BBH', 128 | opcode, 126, n)
+        else:
+            header = struct.pack('>BBQ', 128 | opcode, 127, n)
+        with lock:
+            conn.sendall(header + payload)
+
+    def _serve(self, conn: socket.socket, lock: threading.Lock):
+        try:
+            self._handshake(conn)
+            while True:
+                opcode, payload = self._read_frame(conn)
+                if opcode == 8:
+                    # Echo the close so the client can finish its shutdown
+                    self._send_frame(conn, lock, payload, 8)
+                    conn.close()
+                    return
+                if opcode == 9:
+                    self._send_frame(conn, lock, payload, 10)
+                elif opcode == 1:
+                    request = json.loads(payload)
+                    if request.get('method') == 'SUBSCRIBE':
+                        self.subscribed += [stream.split('@')[0].upper() for stream in request['params']]
+                        self._send_frame(conn, lock, json.dumps({'result': None, 'id': request['id']}).encode())
+                        threading.Thread(target=self._replay, args=(conn, lock), daemon=True).start()
+        except (OSError, ConnectionError):
+            return
+
+    def _replay(self, conn: socket.socket, lock: threading.Lock):
+        # Several subscribe messages on one connection each start a replay; only the first sends
+        with lock:
+            if conn in self.replayed:
+                return
+            self.replayed.add(conn)
+        symbols = [symbol for symbol in self.klines if symbol in self.subscribed]
+        try:
+            for i in range(max((len(self.klines[symbol]) for symbol in symbols), default=0)):
+                with self._released:
+                    self._released.wait_for(lambda: i < self.released)
+                for symbol in symbols:
+                    if i >= len(self.klines[symbol]):
+                        continue
+                    for closed in (False, True):
+                        message = kline_message(symbol, self.interval, self.klines[symbol][i], closed)
+                        self._send_frame(conn, lock, json.dumps(message).encode())
+        except OSError:
+            return
@@ -0,0 +1,55 @@
+import time
+import pytest
+import live_ananke
+from tests.stub import StubBinance, stub_client
+
+
+SYMBOLS = [f'STUB{i}USDC' for i in range(20)]
+
+
+def closed_before_now(stub: StubBinance) -> int:
+    # Both passes stop at the same close, whichever candle opens meanwhile
+    return int(time.time() * 1000) // stub.step * stub.step
+
+
+def sequential_klines(client, symbols: list, end_time: int) -> dict:
+    return {symbol: client.klines(symbol=symbol, interval='5m', endTime=end_time - 1) for symbol in symbols}
+
+
+def concurrent_klines(client, symbols: list, end_time: int, workers: int) -> dict:
+    klines = {}
+    for symbol, rows, error in live_ananke.fetch_klines(client, symbols, '5m', workers, end_time):
+        assert error is None, f'{symbol}: {error}'
+        klines[symbol] = rows
+    return klines
+
+
+@pytest.fixture
+def stub(request):
+    stub = StubBinance(SYMBOLS, latency=getattr(request, 'param', 0.0)).start()
+    yield stub
+    stub.stop()
+
+
+def test_fetch_klines_matches_sequential(stub):
+    client = stub_client(stub)
+    end_time = closed_before_now(stub)
+    assert concurrent_klines(client, SYMBOLS, end_time, 10) == sequential_klines(client, SYMBOLS, end_time)
+    assert stub.requests['/api/v3/klines'] == 2 * len(SYMBOLS)
+
+
+@pytest.mark.parametrize('stub', [0.1], indirect=True)
+def test_fetch_klines_overlaps_requests(stub):
+    workers = 10
+    client = stub_client(stub, workers)
+    end_time = closed_before_now(stub)
+
+    start = time.perf_counter()
+    sequential_klines(client, SYMBOLS, end_time)
+    sequential_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    concurrent_klines(client, SYMBOLS, end_time, workers)
+    concurrent_seconds = time.perf_counter() - start
+
+    # Half the ideal speedup leaves room for a busy machine
+    assert sequential_seconds / concurrent_seconds >= workers / 2
@@ -0,0 +1,131 @@
+import time
+import queue
+import logging
+import numpy as np
+import pytest
+import live_ananke
+from settings import indicators
+from settings import signals
+from settings.klines import interval_ms
+from settings.stream import KlineStream
+from tests.stub import StubBinance, StubKlineStream, recorded_klines, stub_client
+
+
+STEP = interval_ms('5m')
+HISTORY = 500
+
+logger = logging.getLogger('test_stream')
+
+
+def recorded(n_symbols: int, replay: int) -> dict:
+    return recorded_klines([f'STUB{i}USDC' for i in range(n_symbols)], HISTORY + replay,
+                           end=int(time.time() * 1000) // STEP * STEP)
+
+
+def next_close(stream: KlineStream, timeout: float = 10) -> tuple:
+    try:
+        return stream.closed.get(timeout=timeout)
+    except queue.Empty:
+        pytest.fail('no candle closed on the stream')
+
+
+@pytest.fixture
+def stream_of():
+    """Start a stand-in replaying klines[symbol][HISTORY:], and a KlineStream subscribed to it"""
+    started = []
+
+    def start(klines: dict) -> tuple:
+        server = StubKlineStream({symbol: rows[HISTORY:] for symbol, rows in klines.items()}).start()
+        stream = KlineStream(server.url, '5m', buffer_size=HISTORY, logger=logger)
+        started.append((server, stream))
+        stream.start(list(klines))
+        return server, stream
+
+    yield start
+    for server, stream in started:
+        stream.stop()
+        server.stop()
+
+
+def test_replayed_closes_match_a_full_recompute(stream_of):
+    n_symbols, replay = 10, 30
+    klines = recorded(n_symbols, replay)
+    live_ananke.indicator_states.clear()
+    server, stream = stream_of(klines)
+    for symbol, rows in klines.items():
+        stream.seed(symbol, rows[:HISTORY])
+    server.release()
+
+    for n in range(n_symbols * replay):
+        symbol, candles = next_close(stream)
+        # Every close arrives once and in order, with a gap-free buffer ending on it
+        assert candles['timestamp'][-1] == klines[symbol][HISTORY + n // n_symbols][0]
+        assert (np.diff(candles['timestamp']) == STEP).all()
+        close = candles['close']
+        macd = indicators.macd(close)
+        code = signals.crossover_signals(indicators.rsi(close), macd['macd_line'], macd['signal_line'])[-1]
+        assert live_ananke.search_entry_point(candles, symbol)['signal'] == signals.LABELS[int(code)]
+    assert not stream.gaps
+
+
+def test_candle_forming_at_fetch_waits_for_its_close(stream_of):
+    klines = recorded(1, 1)
+    (symbol, rows), = klines.items()
+    server, stream = stream_of(klines)
+    # REST answered while rows[HISTORY] was forming, it closed before the buffer was seeded
+    forming = rows[HISTORY][:2] + [rows[HISTORY][1]] * 3 + rows[HISTORY][5:]
+    stream.seed(symbol, rows[:HISTORY] + [forming], rows[HISTORY][0] + STEP // 2)
+    server.release()
+
+    _, candles = next_close(stream)
+    assert candles['timestamp'][-1] == rows[HISTORY][0]
+    assert candles['close'][-1] == float(rows[HISTORY][4])
+    assert candles['high'][-1] == float(rows[HISTORY][2])
+    assert (np.diff(candles['timestamp']) == STEP).all()
+
+
+def test_gap_waits_for_a_new_seed(stream_of):
+    klines = recorded(2, 2)
+    # The gapped symbol is replayed first, its close is handled before the other one's
+    gapped, steady = klines
+    server, stream = stream_of(klines)
+    stream.seed(gapped, klines[gapped][:HISTORY - 1])
+    stream.seed(steady, klines[steady][:HISTORY])
+    server.release(1)
+    assert next_close(stream)[0] == steady
+    assert stream.gaps == {gapped}
+
+    # run_ananke_stream seeds the gapped symbols again over REST
+    rest = StubBinance([gapped], latency=0).start()
+    rest.klines = {gapped: klines[gapped][:HISTORY + 1]}
+    try:
+        live_ananke.seed_stream(stub_client(rest), stream, sorted(stream.gaps), logger)
+    finally:
+        rest.stop()
+    assert not stream.gaps
+
+    server.release(1)
+    closed = dict(next_close(stream) for _ in range(2))
+    assert set(closed) == {gapped, steady}
+    for symbol, candles in closed.items():
+        assert candles['timestamp'][-1] == klines[symbol][HISTORY + 1][0]
+        assert (np.diff(candles['timestamp']) == STEP).all()
+
+
+def test_reconnect_does_not_repeat_closes(stream_of):
+    klines = recorded(1, 3)
+    (symbol, rows), = klines.items()
+    server, stream = stream_of(klines)
+    stream.seed(symbol, rows[:HISTORY])
+    server.release(2)
+    for n in range(2):
+        assert next_close(stream)[1]['timestamp'][-1] == rows[HISTORY + n][0]
+
+    # The new connection replays the two closes again, they are buffered already
+    stream.restart()
+    assert len(stream.clients) == 1
+    server.release(1)
+    _, candles = next_close(stream)
+    assert candles['timestamp'][-1] == rows[HISTORY + 2][0]
+    assert (np.diff(candles['timestamp']) == STEP).all()
+    assert stream.closed.empty() and not stream.gaps